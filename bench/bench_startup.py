@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Benchmark how long a fresh process takes to import pynats and to publish its first message
+
+Each measurement runs in a new interpreter so nothing is already imported. Exits non-zero if the import takes longer
+than the budget, or if `import pynats` pulls in a module that is meant to be loaded lazily, so it can be used as an
+import time regression check. Run with `python bench/bench_startup.py [--runs N] [--import-budget SECONDS]`.
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules that `import pynats` and `from pynats import NATSClient` must leave for later
+LAZY_ON_IMPORT = ("ssl", "json", "uuid", "pickle", "dataclasses", "pynats.connection")
+LAZY_FOR_CLIENT = ("ssl", "uuid", "pickle", "pynats.codec", "pynats.jetstream", "pynats.watchdog")
+
+# logging and typing are loaded first, since every application pays for them anyway. What's timed is pynats itself
+IMPORT_SCRIPT = """
+import logging, sys, time, typing
+start = time.perf_counter()
+import pynats
+elapsed = time.perf_counter() - start
+loaded = [name for name in {lazy!r} if name in sys.modules]
+from pynats import NATSClient
+loaded += [name + " (client)" for name in {lazy_client!r} if name in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+PUBLISH_SCRIPT = """
+import time
+start = time.perf_counter()
+import pynats
+client = pynats.NATSClient("127.0.0.1", {port})
+client.start()
+client.send("bench.startup", b"hello")
+print(time.perf_counter() - start, client.connect_timings.first_publish)
+client.close()
+"""
+
+
+def serve(listener: socket.socket) -> None:
+    """Just enough of a NATS server to let a client connect and publish"""
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sendall(
+            b'INFO {"server_id":"bench","server_name":"bench","version":"2.10.0","headers":true,'
+            b'"max_payload":1048576,"proto":1} \r\n'
+        )
+        with conn:
+            while conn.recv(4096):
+                pass
+
+
+def run(script: str) -> str:
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def main(runs: int, import_budget: float) -> int:
+    import_times = []
+    eager = set()
+    for _ in range(runs):
+        output = run(IMPORT_SCRIPT.format(lazy=LAZY_ON_IMPORT, lazy_client=LAZY_FOR_CLIENT))
+        elapsed, _, loaded = output.partition(" ")
+        import_times.append(float(elapsed))
+        eager.update(name for name in loaded.split(",") if name)
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    threading.Thread(target=serve, args=(listener,), daemon=True).start()
+    publish_times = []
+    client_times = []
+    for _ in range(runs):
+        total, first_publish = run(PUBLISH_SCRIPT.format(port=listener.getsockname()[1])).split()
+        publish_times.append(float(total))
+        client_times.append(float(first_publish))
+    listener.close()
+
+    import_median = statistics.median(import_times)
+    print(f"import pynats:                  median {import_median * 1e3:8.2f}ms  max {max(import_times) * 1e3:8.2f}ms")
+    print(f"process start to first publish: median {statistics.median(publish_times) * 1e3:8.2f}ms")
+    print(f"client created to first publish: median {statistics.median(client_times) * 1e3:7.2f}ms")
+
+    failed = False
+    if eager:
+        print(f"FAIL: loaded eagerly: {', '.join(sorted(eager))}")
+        failed = True
+    if import_median > import_budget:
+        print(f"FAIL: import took longer than the {import_budget * 1e3:.1f}ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--import-budget", type=float, default=0.005, help="Seconds `import pynats` may take")
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.import_budget))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Benchmark building the subscription table and SUB frames for a large number of subjects
+
+Compares the integer sid SubscriptionTable against the old subject -> uuid4 sid dict, measuring time and the memory
+held by the table (with tracemalloc). Run with `python bench/bench_subscriptions.py [num_subjects ...]`.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats.protocol.wire as wire
+from pynats.protocol.nats import SUB_BATCH_BYTES
+from pynats.protocol.subscriptions import SubscriptionTable
+
+
+def legacyTable(subjects):
+    subscriptions = {}
+    sid_subjects = {}
+    frames = []
+    for subject in subjects:
+        sid = str(uuid.uuid4())
+        subscriptions[subject] = sid
+        sid_subjects[sid] = subject
+        frames.append(wire.buildSub(subject, sid))
+    return (subscriptions, sid_subjects), len(frames)
+
+
+def compactTable(subjects):
+    table = SubscriptionTable()
+    batches = 0
+    batch_b = bytearray()
+    for subject in subjects:
+        batch_b.extend(wire.buildSub(subject, table.add(subject)))
+        if len(batch_b) >= SUB_BATCH_BYTES:
+            batches += 1
+            batch_b.clear()
+    return table, batches + bool(batch_b)
+
+
+def measure(build, subjects):
+    tracemalloc.start()
+    start = time.perf_counter()
+    table, frames = build(subjects)
+    elapsed = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del table
+    return elapsed, held, frames
+
+
+def main(sizes) -> None:
+    print(f"{'subjects':>9} {'table':>8} {'seconds':>8} {'MiB':>8} {'queue puts':>10}")
+    for size in sizes:
+        subjects = [f"devices.{i:08d}.telemetry" for i in range(size)]
+        for name, build in (("legacy", legacyTable), ("compact", compactTable)):
+            elapsed, held, frames = measure(build, subjects)
+            print(f"{size:>9} {name:>8} {elapsed:>8.3f} {held / 2**20:>8.1f} {frames:>10}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 200_000])
@@ -1,16 +1,77 @@
 import logging
+from typing import TYPE_CHECKING
 
-from .connection import NATSClient
-from .protocol.wire import ErrMessage, HmsgMessage, MsgMessage
-from .error import AuthException, NATSException
+if TYPE_CHECKING:
+    from .codec import Codec, CodecRegistry, JsonCodec, PickleCodec, StructCodec
+    from .connection import NATSClient
+    from .error import AuthException, NATSException
+    from .factory import ConnectionFactory
+    from .jetstream import JetStreamMsg, PullConsumer
+    from .mailbox import Mailbox
+    from .protocol.wire import ErrMessage, HmsgMessage, MsgMessage
+    from .ratelimit import RateLimit
+    from .tracing import LatencyHistogram, LatencyTracer
+    from .transport import ConnectTimings, TLSSessionCache
 
 logging.getLogger("pynats").addHandler(logging.NullHandler())
 
+# Submodules are only imported when one of their names is first used, so `import pynats` stays cheap
+_LAZY_ATTRIBUTES = {
+    "NATSClient": ".connection",
+    "ConnectionFactory": ".factory",
+    "ErrMessage": ".protocol.wire",
+    "HmsgMessage": ".protocol.wire",
+    "MsgMessage": ".protocol.wire",
+    "AuthException": ".error",
+    "NATSException": ".error",
+    "Mailbox": ".mailbox",
+    "JetStreamMsg": ".jetstream",
+    "PullConsumer": ".jetstream",
+    "RateLimit": ".ratelimit",
+    "LatencyHistogram": ".tracing",
+    "LatencyTracer": ".tracing",
+    "Codec": ".codec",
+    "CodecRegistry": ".codec",
+    "JsonCodec": ".codec",
+    "PickleCodec": ".codec",
+    "StructCodec": ".codec",
+    "ConnectTimings": ".transport",
+    "TLSSessionCache": ".transport",
+}
+
 __all__ = [
     "NATSClient",
+    "ConnectionFactory",
     "ErrMessage",
     "HmsgMessage",
     "MsgMessage",
     "AuthException",
     "NATSException",
+    "Mailbox",
+    "JetStreamMsg",
+    "PullConsumer",
+    "RateLimit",
+    "LatencyHistogram",
+    "LatencyTracer",
+    "Codec",
+    "CodecRegistry",
+    "JsonCodec",
+    "PickleCodec",
+    "StructCodec",
+    "ConnectTimings",
+    "TLSSessionCache",
 ]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *__all__})
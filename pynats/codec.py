@@ -0,0 +1,106 @@
+"""Payload codecs, looked up by subject pattern"""
+
+import json
+import pickle
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pynats.protocol.wire as wire
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_NOT_CACHED = object()
+
+
+class Codec:
+    """Turns objects into payload bytes and back. `decode` is handed a memoryview of the payload"""
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: Buffer) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def decode(self, data: Buffer) -> Any:
+        return json.loads(bytes(data))
+
+
+class StructCodec(Codec):
+    def __init__(self, fmt: str, record: Optional[type] = None) -> None:
+        """Fixed layout records packed with `struct`
+
+        Inputs:
+            fmt: The struct format, e.g. "<Qd" for a little endian uint64 and a double
+            record: Optionally a type (such as a namedtuple) built from the unpacked fields. Plain tuples otherwise
+        """
+        self.struct = struct.Struct(fmt)
+        self.record = record
+
+    def encode(self, obj: Any) -> bytes:
+        return self.struct.pack(*obj)
+
+    def decode(self, data: Buffer) -> Any:
+        # unpack_from reads straight out of the memoryview without copying the payload
+        fields = self.struct.unpack_from(data)
+        return self.record(*fields) if self.record is not None else fields
+
+
+class PickleCodec(Codec):
+    """Only for subjects where every publisher is trusted, since unpickling can run arbitrary code"""
+
+    def encode(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: Buffer) -> Any:
+        return pickle.loads(data)
+
+
+class CodecRegistry:
+    def __init__(self, max_cached_subjects: int = 10000) -> None:
+        """Codecs registered against subject patterns (wildcards allowed). The most specific matching pattern wins:
+        no wildcards, then fewer `*`, then `>`. The codec found for each subject is cached.
+        """
+        self.max_cached_subjects = max_cached_subjects
+        self.__patterns: List[Tuple[str, Codec]] = []
+        self.__cache: Dict[str, Optional[Codec]] = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __specificity(pattern: str) -> tuple:
+        tokens = pattern.split(".")
+        return (tokens[-1] == ">", tokens.count("*"), -len(tokens))
+
+    def register(self, pattern: str, codec: Optional[Codec]) -> None:
+        """Use `codec` for subjects matching `pattern`. None removes the pattern"""
+        with self.__lock:
+            self.__patterns = [entry for entry in self.__patterns if entry[0] != pattern]
+            if codec is not None:
+                self.__patterns.append((pattern, codec))
+                self.__patterns.sort(key=lambda entry: self.__specificity(entry[0]))
+            self.__cache.clear()
+
+    def codecFor(self, subject: str) -> Optional[Codec]:
+        codec = self.__cache.get(subject, _NOT_CACHED)
+        if codec is not _NOT_CACHED:
+            return codec
+        with self.__lock:
+            codec = next((codec for pattern, codec in self.__patterns if wire.subjectMatches(pattern, subject)), None)
+            if len(self.__cache) >= self.max_cached_subjects:
+                self.__cache.clear()
+            self.__cache[subject] = codec
+        return codec
+
+    def encode(self, subject: str, obj: Any) -> bytes:
+        """Encode with the subject's codec. Bytes pass through untouched"""
+        if isinstance(obj, (bytes, bytearray)):
+            return bytes(obj)
+        codec = self.codecFor(subject)
+        if codec is None:
+            raise TypeError(f"No codec registered for '{subject}' and the payload isn't bytes")
+        return codec.encode(obj)
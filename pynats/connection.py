@@ -1,14 +1,26 @@
 """Connection wrapper for NATS protocol client"""
 
 import logging
-import ssl
-from queue import Queue
+import time
+from queue import Empty, Queue
 from threading import Event
-from typing import Callable, Optional, Union
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Tuple, Union
 
 import pynats.protocol.nats as nats_protocol
+import pynats.protocol.wire as wire
 import pynats.transport as transport
 
+if TYPE_CHECKING:
+    # The optional components are imported when a client first uses them, to keep startup fast
+    import ssl
+
+    from pynats.codec import Codec
+    from pynats.dedup import DedupFilter
+    from pynats.mailbox import Mailbox
+    from pynats.ratelimit import RateLimit
+    from pynats.tracing import LatencyTracer
+    from pynats.watchdog import CallbackWatchdog
+
 
 class NATSClient:
     def __init__(
@@ -18,8 +30,24 @@ class NATSClient:
         user: Optional[str] = "",
         password: Optional[str] = "",
         auth_token: Optional[str] = "",
-        tls: Optional[ssl.SSLContext] = None,
+        tls: Optional["ssl.SSLContext"] = None,
         callback: Optional[Callable] = None,
+        tls_first: bool = False,
+        connect_timeout: float = 2.0,
+        tls_session_cache: Optional[transport.TLSSessionCache] = None,
+        no_echo: bool = False,
+        local_delivery: bool = False,
+        rate_limit: Optional["RateLimit"] = None,
+        rate_limit_policy: str = "block",
+        callback_budget: Optional[float] = None,
+        stamp_msg_id: bool = False,
+        dedup_window: Optional[float] = None,
+        dedup_max_ids: int = 100000,
+        dedup_bloom_bits: int = 0,
+        trace: bool = False,
+        trace_sample_rate: float = 1.0,
+        address: Optional[Tuple[str, int]] = None,
+        connect_frames: Optional[dict] = None,
     ) -> None:
         """Create a NATS Client
 
@@ -31,25 +59,124 @@ class NATSClient:
             auth_token: The auth token, if the server requires it
             tls: A ssl.SSLContext to wrap the TCP socket with to upgrade the connection to TLS
             callback: A callable method as a catch-all message callback
-
+            tls_first: Do the TLS handshake straight after the TCP connect instead of after the server's INFO.
+                The server must be configured for TLS-first (handshake_first) for this to work
+            connect_timeout: Seconds to wait for the TCP connect and the TLS handshake
+            tls_session_cache: Where TLS sessions are stored for resumption. Defaults to a cache shared by
+                every client in the process, so pooled clients and restarts skip the full handshake
+            no_echo: Ask the server not to send this client's own publishes back to it
+            local_delivery: Deliver publishes that match this client's own (non queue group) subscriptions straight
+                to the local callbacks. The message is still published for everyone else. Implies no_echo.
+                Local callbacks run on the thread that called `send`, not the protocol thread, before `send`
+                returns. A callback that publishes to a subject it is subscribed to recurses instead of going
+                round through the server
+            rate_limit: A RateLimit for everything this client publishes. Per prefix limits are set with
+                `setSubjectRateLimit`
+            rate_limit_policy: What `send` does when over a limit: "block" until it fits, "queue" it to be paced out
+                by a background thread, or "fail" and return False
+            callback_budget: Seconds a callback may run before a watchdog thread reports it with a sample of its
+                stack. Callbacks aren't timed if this isn't set
+            stamp_msg_id: Give every sent message a unique Nats-Msg-Id header, unless `send` is given one
+            dedup_window: Seconds to remember received Nats-Msg-Id headers for (per subscription), dropping repeats
+                before they reach any callback. JetStream deliveries aren't checked, so redeliveries get through.
+                Received messages aren't checked if this isn't set
+            dedup_max_ids: The most ids remembered exactly
+            dedup_bloom_bits: Size of a bloom filter that also remembers ids for the whole window, for windows
+                holding more than `dedup_max_ids` ids. 0 disables it
+            trace: Stamp sent messages with their publish time and a trace id, and record how long received stamped
+                messages spent getting here, waiting to be dispatched, and in callbacks. See `latencyReport`
+            trace_sample_rate: The fraction of sent messages that are stamped when tracing
+            address: An already resolved (ip, port) to connect to instead of looking up `host`. `host` is still
+                used to check the server's TLS certificate
+            connect_frames: A dict shared between clients to cache their built CONNECT frames in
 
         NOTE: It is recommended that your "callback" methods just append to your own queue rather than
         actually process messages so that the socket select doesn't get blocked by function execution.
         """
+        # What connect_timings.first_publish is measured from
+        self.__first_publish_since = time.perf_counter()
+        from pynats.ratelimit import POLICIES
+
+        if rate_limit_policy not in POLICIES:
+            raise ValueError(f"Rate limit policy must be one of {POLICIES}")
         recv_queue = Queue(50)
         send_queue = Queue(50)
         self.connected = Event()
         self.__logger = logging.getLogger("pynats")
-        self.__transport = transport.Transport(host, port, recv_queue, send_queue)
-        self.__nats_protocol = nats_protocol.Protocol(self.__transport, user, password, auth_token, tls, self.connected)
+        self.__transport = transport.Transport(
+            host, port, recv_queue, send_queue, tls, tls_first, connect_timeout, tls_session_cache, address
+        )
+        self.__nats_protocol = nats_protocol.Protocol(
+            self.__transport, user, password, auth_token, tls, self.connected, no_echo, local_delivery
+        )
         self.__nats_protocol.addCB(callback)
+        self.__nats_protocol.connect_frames = connect_frames
+        self.__rate_limit_policy = rate_limit_policy
+        if rate_limit is not None:
+            from pynats.ratelimit import RateLimiter
+
+            self.__nats_protocol.rate_limiter = RateLimiter(rate_limit, rate_limit_policy)
+        self.__stamp_msg_id = stamp_msg_id
+        if dedup_window is not None:
+            from pynats.dedup import DedupFilter
+
+            self.__nats_protocol.dedup = DedupFilter(dedup_window, dedup_max_ids, dedup_bloom_bits)
+        if callback_budget is not None:
+            from pynats.watchdog import CallbackWatchdog
+
+            self.__nats_protocol.watchdog = CallbackWatchdog(callback_budget)
+        if trace:
+            from pynats.tracing import LatencyTracer
+
+            self.__nats_protocol.tracer = LatencyTracer(trace_sample_rate)
 
     def start(self) -> None:
-        """Start the NATS protocol. Connect the socket, wait for the INFO frame, then send the CONNECT frame"""
+        """Start the NATS protocol. Connect the socket, wait for the INFO frame, then send the CONNECT frame
+
+        Raises the OSError (e.g. an ssl.SSLError) if the connection or TLS handshake fails, or a RuntimeError if the
+        server requires TLS and no SSLContext was given.
+        """
         self.__logger.debug("Starting NATS client")
         self.__nats_protocol.start()
 
         self.connected.wait()
+        if self.__nats_protocol.connect_error is not None:
+            self.__nats_protocol.join()
+            raise self.__nats_protocol.connect_error
+
+    @property
+    def connect_timings(self) -> transport.ConnectTimings:
+        """Seconds spent in the TCP, INFO, TLS and CONNECT phases of the last start, and from creating the client (or
+        handing it out of a ConnectionFactory's warm pool) to its first publish
+        """
+        return self.__transport.timings
+
+    def resetFirstPublish(self) -> None:
+        """Measure `connect_timings.first_publish` from now rather than from when the client was created, e.g. when
+        a client that was connected ahead of time is handed out
+        """
+        self.__first_publish_since = time.perf_counter()
+        self.__transport.timings.first_publish = 0.0
+
+    @property
+    def server_info(self) -> Optional[nats_protocol.InfoOptions]:
+        """The options the server sent in its INFO"""
+        return self.__nats_protocol.info_options
+
+    @property
+    def dedup(self) -> Optional["DedupFilter"]:
+        """Duplicate counters for received messages, if `dedup_window` was set"""
+        return self.__nats_protocol.dedup
+
+    @property
+    def watchdog(self) -> Optional["CallbackWatchdog"]:
+        """Callback timings and slow callback reports, if `callback_budget` was set"""
+        return self.__nats_protocol.watchdog
+
+    @property
+    def tracer(self) -> Optional["LatencyTracer"]:
+        """Latency histograms of received traced messages, if `trace` was set"""
+        return self.__nats_protocol.tracer
 
     def close(self) -> None:
         """Close the NATS client, disconnecting from the server"""
@@ -57,26 +184,102 @@ class NATSClient:
         self.__nats_protocol.close()
         self.__nats_protocol.join()
 
-    def send(self, subject: str, payload: bytes, header: dict = None, reply_to: str = None) -> None:
+    def send(self, subject: str, payload: bytes, header: dict = None, reply_to: str = None, msg_id: str = None) -> bool:
         """Send a message to the given subject. Payload should already be of type `bytes`.
 
         `header` should be a dictionary of headers, which will be ignored if the server indicates that it doesn't
         support headers.
+
+        `msg_id` is sent as the Nats-Msg-Id header. Resend with the same id so receivers (and JetStream) can drop
+        the duplicate.
         """
+        codecs = self.__nats_protocol.codecs
+        if codecs is not None and isinstance(subject, str) and not isinstance(payload, bytes):
+            try:
+                payload = codecs.encode(subject, payload)
+            except (TypeError, ValueError) as e:
+                self.__logger.error("Couldn't encode payload for %s: %s", subject, e)
+                return False
         if not (
             isinstance(subject, str) and isinstance(payload, bytes) and (isinstance(reply_to, str) or reply_to is None)
         ):
             self.__logger.error("'subject' must be a string and 'payload' must be bytes")
             return False
 
+        if msg_id is None and self.__stamp_msg_id:
+            msg_id = nats_protocol.createMsgId()
+        if msg_id is not None:
+            header = {**(header or {}), wire.MSG_ID_HEADER: msg_id}
+        if self.__nats_protocol.tracer is not None:
+            header = self.__nats_protocol.tracer.stamp(header)
+
         if header is not None and not self.__nats_protocol.info_options.headers:
             self.__logger.warning(
                 "Headers were provided, but the server indicated that it doesn't want headers. Dropping headers and sending message"
             )
             header = None
 
-        self.__nats_protocol.send(subject, payload, header, reply_to)
-        return True
+        sent = self.__nats_protocol.send(subject, payload, header, reply_to)
+        timings = self.__transport.timings
+        if sent and not timings.first_publish:
+            timings.first_publish = time.perf_counter() - self.__first_publish_since
+        return sent
+
+    def registerCodec(self, pattern: str, codec: Optional["Codec"]) -> None:
+        """Encode payloads sent to subjects matching `pattern` with `codec`, and decode received ones into `msg.data`
+        the first time it's read. None removes the pattern
+        """
+        if self.__nats_protocol.codecs is None:
+            from pynats.codec import CodecRegistry
+
+            self.__nats_protocol.codecs = CodecRegistry()
+        self.__nats_protocol.codecs.register(pattern, codec)
+
+    def setSubjectRateLimit(self, prefix: str, limit: Optional["RateLimit"]) -> None:
+        """Limit publishes to subjects starting with `prefix`, on top of any client wide limit. None removes it"""
+        if self.__nats_protocol.rate_limiter is None:
+            from pynats.ratelimit import RateLimiter
+
+            self.__nats_protocol.rate_limiter = RateLimiter(None, self.__rate_limit_policy)
+        self.__nats_protocol.rate_limiter.setSubjectLimit(prefix, limit)
+
+    def rateLimitStats(self) -> dict:
+        """Counts of publishes allowed, delayed, queued and rejected by the rate limits"""
+        if self.__nats_protocol.rate_limiter is None:
+            return {}
+        return self.__nats_protocol.rate_limiter.stats()
+
+    def latencyReport(self, subject: Optional[str] = None) -> dict:
+        """Latency percentiles, in seconds, of received traced messages on `subject` (or all subjects) for each stage:
+        publish to parse (network and server), parse to dispatch (this client's queues) and dispatch to complete
+        (callbacks)
+        """
+        if self.__nats_protocol.tracer is None:
+            return {}
+        return self.__nats_protocol.tracer.report(subject)
+
+    def sendBatch(self, messages: List[Tuple[str, bytes]]) -> None:
+        """Send a list of (subject, payload) messages in one write. These skip the rate limits"""
+        self.__nats_protocol.sendBatch(messages)
+
+    def request(
+        self, subject: str, payload: bytes, header: dict = None, timeout: float = 1.0
+    ) -> Union[wire.MsgMessage, wire.HmsgMessage, None]:
+        """Send a message with a unique reply subject and wait up to `timeout` seconds for the first reply"""
+        inbox = nats_protocol.createInbox()
+        replies = Queue()
+        callback_id = self.__nats_protocol.addCB(replies.put, inbox)
+        self.__nats_protocol.sub(inbox)
+        try:
+            if not self.send(subject, payload, header, inbox):
+                return None
+            return replies.get(timeout=timeout)
+        except Empty:
+            self.__logger.debug("No reply to request on %s within %ss", subject, timeout)
+            return None
+        finally:
+            self.__nats_protocol.removeCB(callback_id, inbox)
+            self.__nats_protocol.unsub(inbox)
 
     def addCallback(self, callback: Callable, subject: str = "") -> Union[str, None]:
         """Add a callback, optionally specifying a subject to associate it with"""
@@ -90,10 +293,36 @@ class NATSClient:
         """Remove a callback, optionally from a subject, corresponding to the given callback ID"""
         return self.__nats_protocol.removeCB(callback_id, subject)
 
-    def subscribe(self, subject: str, queue_group: str = None):
-        """Subscribe to a subject"""
-        self.__nats_protocol.sub(subject, queue_group)
+    def subscribe(self, subject: str, queue_group: str = None) -> int:
+        """Subscribe to a subject, returning the subscription's sid. A subject can be subscribed to more than once,
+        e.g. in different queue groups, and its callbacks still run once per message
+        """
+        return self.__nats_protocol.sub(subject, queue_group)
+
+    def unsubscribe(self, subject: str, messages_to_wait_for: int = 0, sid: int = None) -> bool:
+        """Unsubscribe from a subject. Every subscription to it is removed unless `sid` picks one"""
+        return self.__nats_protocol.unsub(subject, messages_to_wait_for, sid)
+
+    def subscribeMany(self, subjects: Iterable[str], queue_group: str = None) -> List[int]:
+        """Subscribe to a large number of subjects, sending the SUBs in big batches. Returns the sids in order"""
+        return self.__nats_protocol.subMany(subjects, queue_group)
+
+    def unsubscribeMany(self, subjects: Iterable[str]) -> int:
+        """Unsubscribe from a large number of subjects in big batches. Returns how many subscriptions were removed"""
+        return self.__nats_protocol.unsubMany(subjects)
+
+    def mailbox(
+        self, subject: str, queue_group: str = None, key_header: Optional[str] = None, max_keys: int = 10000
+    ) -> "Mailbox":
+        """Subscribe to a subject and collect its messages in a conflating Mailbox, which only keeps the newest
+        unread message per subject (or per value of `key_header`). Read from it with `Mailbox.get`/`Mailbox.drain`.
+        """
+        from pynats.mailbox import Mailbox
+
+        mailbox = Mailbox(subject, key_header, max_keys)
+        mailbox.sid = self.__nats_protocol.sub(subject, queue_group, callback=mailbox)
+        return mailbox
 
-    def unsubscribe(self, subject: str, messages_to_wait_for: int = 0):
-        """Unsubscribe from a subject"""
-        self.__nats_protocol.unsub(subject, messages_to_wait_for)
+    def closeMailbox(self, mailbox: "Mailbox") -> None:
+        """Stop delivering to a mailbox and unsubscribe from its subject"""
+        self.__nats_protocol.unsub(mailbox.subject, sid=mailbox.sid)
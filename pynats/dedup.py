@@ -0,0 +1,114 @@
+"""Drop messages whose Nats-Msg-Id has already been seen recently"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class _RotatingBloom:
+    """Two bloom filter generations. Ids are added to the current one and looked up in both, and the older one is
+    thrown away every `period` seconds, so an id is remembered for between one and two periods.
+    """
+
+    def __init__(self, bits: int, hashes: int, period: float) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self.period = period
+        self.current = bytearray((bits + 7) // 8)
+        self.previous = bytearray((bits + 7) // 8)
+        self.rotated = time.monotonic()
+
+    def __indexes(self, msg_id: str):
+        digest = hashlib.blake2b(msg_id.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def __rotate(self, now: float) -> None:
+        if now - self.rotated < self.period:
+            return
+        # Skipped more than one period, so both generations are stale
+        self.previous = self.current if now - self.rotated < 2 * self.period else bytearray(len(self.current))
+        self.current = bytearray(len(self.current))
+        self.rotated = now
+
+    def checkAndAdd(self, msg_id: str, now: float) -> bool:
+        """Add an id, returning True if it was (probably) already there"""
+        self.__rotate(now)
+        seen_current = True
+        seen_previous = True
+        for index in self.__indexes(msg_id):
+            byte, bit = divmod(index, 8)
+            mask = 1 << bit
+            seen_current = seen_current and bool(self.current[byte] & mask)
+            seen_previous = seen_previous and bool(self.previous[byte] & mask)
+            self.current[byte] |= mask
+        return seen_current or seen_previous
+
+
+class DedupFilter:
+    def __init__(
+        self, window: float = 120.0, max_ids: int = 100000, bloom_bits: int = 0, bloom_hashes: int = 4
+    ) -> None:
+        """Remember message ids for `window` seconds and report repeats as duplicates
+
+        Ids are kept exactly, in the order they were first seen, until they are older than the window or the
+        oldest of more than `max_ids`. A repeat doesn't extend how long an id is kept. For windows holding more ids
+        than that, set `bloom_bits` to also keep them in a bloom filter, which remembers ids for between one and two
+        windows. Ids pushed out early are still caught by the bloom filter, at the cost of the occasional false
+        positive (about 2% with 4 hashes and 8 bits per id).
+        """
+        self.window = window
+        self.max_ids = max_ids
+        self.__seen: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self.__bloom = _RotatingBloom(bloom_bits, bloom_hashes, window) if bloom_bits else None
+        self.__lock = threading.Lock()
+
+        self.checked = 0
+        self.duplicates = 0
+        self.bloom_duplicates = 0
+        self._logger = logging.getLogger("pynats.dedup")
+
+    def __expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self.__seen:
+            oldest_id, seen_at = next(iter(self.__seen.items()))
+            if seen_at >= cutoff and len(self.__seen) < self.max_ids:
+                break
+            self.__seen.pop(oldest_id)
+
+    def isDuplicate(self, msg_id: Optional[str], sid: str = "") -> bool:
+        """Record an id and check if it was already seen within the window. Messages without an id always pass
+
+        Ids are remembered per `sid`, since the server sends a copy of a message (with the same id) to each
+        subscription it matches, and every one of those copies should be delivered.
+        """
+        if not msg_id:
+            return False
+        key = (sid, msg_id)
+        now = time.monotonic()
+        with self.__lock:
+            self.checked += 1
+            self.__expire(now)
+            in_bloom = self.__bloom.checkAndAdd(f"{sid} {msg_id}", now) if self.__bloom is not None else False
+            if key in self.__seen:
+                self.duplicates += 1
+                return True
+            self.__seen[key] = now
+            if in_bloom:
+                self.duplicates += 1
+                self.bloom_duplicates += 1
+                return True
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "checked": self.checked,
+                "duplicates": self.duplicates,
+                "bloom_duplicates": self.bloom_duplicates,
+                "tracked": len(self.__seen),
+            }
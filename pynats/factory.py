@@ -0,0 +1,145 @@
+"""Build NATS clients with as much of the connection work as possible done ahead of time"""
+
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, Optional, Tuple, Union
+
+from pynats.connection import NATSClient
+
+if TYPE_CHECKING:
+    import ssl
+
+
+class ConnectionFactory:
+    def __init__(
+        self, host: str, port: int, tls: Union[bool, "ssl.SSLContext"] = False, warm: int = 0, **client_options
+    ) -> None:
+        """Hands out connected NATSClients for one server
+
+        The server's address is resolved and the SSLContext built once, up front, and CONNECT frames are built once
+        and shared. Sharing the SSLContext also lets every client resume the first one's TLS session. With `warm`
+        set, that many clients are kept connected by a background thread so `get` doesn't wait on a connect.
+
+        Inputs:
+            host: The hostname of the NATS server
+            port: The port of the NATS server
+            tls: True to build a default SSLContext for every client to share, or the SSLContext to share
+            warm: How many connected clients to keep ready to hand out
+            client_options: Any other NATSClient arguments, e.g. `user` and `password`, used for every client
+        """
+        self.host = host
+        self.port = port
+        self.warm = warm
+        self.client_options = client_options
+        self.tls = tls if not isinstance(tls, bool) else None
+        if tls is True:
+            import ssl
+
+            self.tls = ssl.create_default_context()
+        self.address: Optional[Tuple[str, int]] = None
+        self.connect_frames: Dict[tuple, bytes] = {}
+
+        self.created = 0
+        self.warm_hits = 0
+        self.cold_starts = 0
+        self.start_time = 0.0
+        self.__warm: Deque[NATSClient] = deque()
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__thread: threading.Thread = None
+        self._logger = logging.getLogger("pynats.factory")
+
+        self.resolve()
+        if warm:
+            self.__thread = threading.Thread(target=self.__thread_refill, daemon=True)
+            self.__thread.start()
+
+    def resolve(self) -> Optional[Tuple[str, int]]:
+        """Look the host up (again, e.g. after a DNS change). Clients created afterwards connect to the new address"""
+        try:
+            infos = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            self._logger.warning("Couldn't resolve %s, clients will look it up themselves: %s", self.host, e)
+            self.address = None
+        else:
+            self.address = infos[0][4][:2]
+        return self.address
+
+    def create(self) -> NATSClient:
+        """Create and start a new client, bypassing the warm ones"""
+        start = time.perf_counter()
+        client = NATSClient(
+            self.host,
+            self.port,
+            tls=self.tls,
+            address=self.address,
+            connect_frames=self.connect_frames,
+            **self.client_options,
+        )
+        client.start()
+        with self.__cond:
+            self.created += 1
+            self.start_time += time.perf_counter() - start
+        return client
+
+    def get(self) -> NATSClient:
+        """A connected client, warm if there is one ready. The caller owns it and is responsible for closing it"""
+        with self.__cond:
+            client = self.__warm.popleft() if self.__warm else None
+            if client is not None:
+                self.warm_hits += 1
+                self.__cond.notify()
+            else:
+                self.cold_starts += 1
+        if client is None:
+            return self.create()
+        # Time spent waiting in the pool isn't part of its cold start
+        client.resetFirstPublish()
+        return client
+
+    def __thread_refill(self) -> None:
+        while True:
+            with self.__cond:
+                while not self.__closed and len(self.__warm) >= self.warm:
+                    self.__cond.wait()
+                if self.__closed:
+                    return
+            try:
+                client = self.create()
+            except OSError as e:
+                self._logger.error("Couldn't connect a warm client: %s", e)
+                with self.__cond:
+                    self.__cond.wait(1.0)
+                continue
+            with self.__cond:
+                if not self.__closed:
+                    self.__warm.append(client)
+                    continue
+            client.close()
+            return
+
+    def close(self) -> None:
+        """Stop keeping clients warm and close the ones that were never handed out"""
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+        with self.__cond:
+            clients = list(self.__warm)
+            self.__warm.clear()
+        for client in clients:
+            client.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self.__cond:
+            return {
+                "warm": len(self.__warm),
+                "created": self.created,
+                "warm_hits": self.warm_hits,
+                "cold_starts": self.cold_starts,
+                "mean_start_time": self.start_time / self.created if self.created else 0.0,
+            }
@@ -0,0 +1,291 @@
+"""JetStream pull consumer built on request/reply, with batched fetches and batched acks"""
+
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from queue import Empty, Queue
+from typing import Dict, List, Optional, Tuple, Union
+
+import pynats.protocol.wire as wire
+from pynats.error import NATSException
+from pynats.protocol.nats import createInbox
+
+# Ack payloads
+ACK = b"+ACK"
+NAK = b"-NAK"
+IN_PROGRESS = b"+WPI"
+TERM = b"+TERM"
+
+# Statuses the server sends on a pull request's reply subject
+STATUS_HEARTBEAT = "100"
+STATUS_NO_MESSAGES = "404"
+STATUS_REQUEST_TIMEOUT = "408"
+STATUS_CONFLICT = "409"
+
+
+@dataclass
+class JetStreamMetadata:
+    """Delivery details encoded in a JetStream message's $JS.ACK reply subject"""
+
+    stream: str
+    consumer: str
+    num_delivered: int
+    stream_seq: int
+    consumer_seq: int
+    # Nanoseconds since the epoch
+    timestamp: int
+    num_pending: int
+    domain: str = ""
+
+    @staticmethod
+    def parse(reply_to: str) -> Optional["JetStreamMetadata"]:
+        tokens = reply_to.split(".")
+        if len(tokens) < 9 or tokens[0] != "$JS" or tokens[1] != "ACK":
+            return None
+        domain = ""
+        if len(tokens) == 9:
+            # $JS.ACK.<stream>.<consumer>.<delivered>.<stream seq>.<consumer seq>.<timestamp>.<pending>
+            fields = tokens[2:]
+        elif len(tokens) >= 11:
+            # $JS.ACK.<domain>.<account hash>.<stream>.<consumer>.<delivered>.<stream seq>.<consumer seq>...
+            domain = "" if tokens[2] == "_" else tokens[2]
+            fields = tokens[4:]
+        else:
+            return None
+        stream, consumer, delivered, stream_seq, consumer_seq, timestamp, pending = fields[:7]
+        try:
+            return JetStreamMetadata(
+                stream,
+                consumer,
+                int(delivered),
+                int(stream_seq),
+                int(consumer_seq),
+                int(timestamp),
+                int(pending),
+                domain,
+            )
+        except ValueError:
+            return None
+
+
+class JetStreamMsg:
+    def __init__(self, msg: Union[wire.MsgMessage, wire.HmsgMessage], consumer: "PullConsumer") -> None:
+        self.msg = msg
+        self.subject = msg.subject
+        self.payload = msg.payload
+        self.header = getattr(msg, "header", {})
+        self.reply_to = msg.reply_to
+        self.metadata = JetStreamMetadata.parse(msg.reply_to)
+        self.__consumer = consumer
+        self.__acked = False
+
+    @property
+    def data(self):
+        """The payload decoded by the subject's codec, if one is registered"""
+        return self.msg.data
+
+    def __repr__(self) -> str:
+        return f"JetStreamMsg(subject={self.subject!r}, metadata={self.metadata}, payload={self.payload!r})"
+
+    def __respond(self, kind: bytes) -> bool:
+        if self.__acked:
+            return False
+        self.__acked = True
+        self.__consumer.queueAck(self.reply_to, kind)
+        return True
+
+    def ack(self) -> bool:
+        return self.__respond(ACK)
+
+    def nak(self, delay: Optional[float] = None) -> bool:
+        """Ask for redelivery, optionally after `delay` seconds"""
+        if delay is None:
+            return self.__respond(NAK)
+        return self.__respond(NAK + b" " + json.dumps({"delay": int(delay * 1e9)}).encode())
+
+    def term(self) -> bool:
+        """Tell the server to never redeliver this message"""
+        return self.__respond(TERM)
+
+    def inProgress(self) -> None:
+        """Reset the server's ack timer while still working on the message. Sent straight away"""
+        if not self.__acked:
+            self.__consumer.queueAck(self.reply_to, IN_PROGRESS, flush=True)
+
+
+class PullConsumer:
+    def __init__(
+        self,
+        client,
+        stream: str,
+        consumer: str,
+        batch: int = 100,
+        expires: float = 5.0,
+        max_bytes: int = 0,
+        ack_interval: float = 0.1,
+        ack_batch: int = 256,
+        ack_all: bool = False,
+    ) -> None:
+        """Fetch messages from an existing durable pull consumer in batches and acknowledge them in batches
+
+        Inputs:
+            client: A started NATSClient
+            stream: The stream name
+            consumer: The durable consumer name
+            batch: The most messages a fetch asks for
+            expires: Seconds the server holds a fetch open waiting for messages. 0 returns immediately
+            max_bytes: The most payload bytes a fetch asks for. 0 is no limit
+            ack_interval: Seconds between flushes of queued acks
+            ack_batch: Flush straight away once this many acks are queued
+            ack_all: The consumer uses the AckAll policy, so only the +ACK with the highest consumer sequence in each
+                flush is sent
+        """
+        info = client.server_info
+        if info is not None and not info.jetstream:
+            raise NATSException("The server doesn't have JetStream enabled")
+
+        self.stream = stream
+        self.consumer = consumer
+        self.batch = batch
+        self.expires = expires
+        self.max_bytes = max_bytes
+        self.ack_batch = ack_batch
+        self.ack_all = ack_all
+        self.next_subject = f"$JS.API.CONSUMER.MSG.NEXT.{stream}.{consumer}"
+
+        self.fetched = 0
+        self.acks_sent = 0
+        self.requests = 0
+        # From the Nats-Pending-* headers of the last status that carried them
+        self.pending_messages = 0
+        self.pending_bytes = 0
+
+        self.__client = client
+        self.__inbox = createInbox()
+        self.__request_id = 0
+        self.__msgs: Queue = Queue()
+        self.__acks: List[Tuple[str, bytes]] = []
+        self.__acks_lock = threading.Lock()
+        self.__closed = threading.Event()
+        self._logger = logging.getLogger("pynats.jetstream")
+
+        self.__callback_id = client.addCallback(self.__msgs.put, f"{self.__inbox}.*")
+        client.subscribe(f"{self.__inbox}.*")
+        self.__flusher = threading.Thread(target=self.__thread_flush, args=(ack_interval,), daemon=True)
+        self.__flusher.start()
+
+    def fetch(
+        self, batch: Optional[int] = None, expires: Optional[float] = None, max_bytes: Optional[int] = None
+    ) -> List[JetStreamMsg]:
+        """Request a batch of messages and return once it is full or the server says there are no more
+
+        Raises NATSException if the request couldn't be sent.
+        """
+        batch = self.batch if batch is None else batch
+        expires = self.expires if expires is None else expires
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        request = {"batch": batch}
+        if expires:
+            request["expires"] = int(expires * 1e9)
+        else:
+            request["no_wait"] = True
+        if max_bytes:
+            request["max_bytes"] = max_bytes
+
+        # Anything acked since the last flush goes out ahead of the request
+        self.flushAcks()
+        self.__request_id += 1
+        reply_to = f"{self.__inbox}.{self.__request_id}"
+        self.requests += 1
+        if not self.__client.send(self.next_subject, json.dumps(request).encode(), None, reply_to):
+            # Rejected by a "fail" rate limit, for example, so there is no point waiting for a reply
+            raise NATSException(f"Couldn't send the pull request for {self.stream}/{self.consumer}")
+
+        # Give the server a moment past `expires` to send its 408
+        deadline = time.monotonic() + expires + 1.0
+        msgs = []
+        while len(msgs) < batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                msg = self.__msgs.get(timeout=remaining)
+            except Empty:
+                break
+            status = getattr(msg, "status", "")
+            if not status:
+                msgs.append(JetStreamMsg(msg, self))
+                continue
+            if msg.subject != reply_to or status == STATUS_HEARTBEAT:
+                # Left over from an earlier request
+                continue
+            self.__recordPending(msg.header)
+            if status not in (STATUS_NO_MESSAGES, STATUS_REQUEST_TIMEOUT):
+                self._logger.warning("Pull request for %s ended with %s %s", self.consumer, status, msg.description)
+            break
+
+        self.fetched += len(msgs)
+        return msgs
+
+    def __recordPending(self, header: Dict[str, str]) -> None:
+        if "Nats-Pending-Messages" in header:
+            self.pending_messages = int(header["Nats-Pending-Messages"])
+        if "Nats-Pending-Bytes" in header:
+            self.pending_bytes = int(header["Nats-Pending-Bytes"])
+
+    def queueAck(self, reply_to: str, kind: bytes, flush: bool = False) -> None:
+        with self.__acks_lock:
+            self.__acks.append((reply_to, kind))
+            flush = flush or len(self.__acks) >= self.ack_batch
+        if flush:
+            self.flushAcks()
+
+    def flushAcks(self) -> None:
+        with self.__acks_lock:
+            acks, self.__acks = self.__acks, []
+        if self.ack_all:
+            # Acking a message acks everything delivered before it, so only the highest consumer sequence is sent,
+            # whatever order the messages were acked in
+            last_ack = max(
+                (i for i, (_, kind) in enumerate(acks) if kind == ACK),
+                key=lambda i: self.__consumerSeq(acks[i][0]),
+                default=None,
+            )
+            acks = [ack for i, ack in enumerate(acks) if ack[1] != ACK or i == last_ack]
+        if not acks:
+            return
+        self.__client.sendBatch(acks)
+        self.acks_sent += len(acks)
+        self._logger.debug("Flushed %s acks", len(acks))
+
+    @staticmethod
+    def __consumerSeq(reply_to: str) -> int:
+        metadata = JetStreamMetadata.parse(reply_to)
+        return metadata.consumer_seq if metadata is not None else -1
+
+    def __thread_flush(self, interval: float) -> None:
+        while not self.__closed.wait(interval):
+            self.flushAcks()
+
+    def close(self) -> None:
+        """Flush outstanding acks and stop listening for messages"""
+        self.__closed.set()
+        self.__flusher.join()
+        self.flushAcks()
+        self.__client.removeCallback(self.__callback_id, f"{self.__inbox}.*")
+        self.__client.unsubscribe(f"{self.__inbox}.*")
+
+    def stats(self) -> Dict[str, int]:
+        with self.__acks_lock:
+            queued = len(self.__acks)
+        return {
+            "requests": self.requests,
+            "fetched": self.fetched,
+            "acks_sent": self.acks_sent,
+            "acks_queued": queued,
+            "pending_messages": self.pending_messages,
+            "pending_bytes": self.pending_bytes,
+        }
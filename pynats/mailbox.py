@@ -0,0 +1,109 @@
+"""Mailboxes that conflate messages, keeping only the newest value per key"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+import pynats.protocol.wire as wire
+
+Message = Union[wire.MsgMessage, wire.HmsgMessage]
+
+
+class Mailbox:
+    def __init__(self, subject: str, key_header: Optional[str] = None, max_keys: int = 10000) -> None:
+        """A bounded mailbox that only keeps the newest unread message for each key
+
+        A message that arrives for a key which already has an unread message overwrites it, and counts as
+        conflated. Keys are handed out in the order they first became pending, so a busy key can't starve
+        the others. Memory and the work needed to catch up are bounded by the number of keys, not the
+        message rate.
+
+        Inputs:
+            subject: The subject this mailbox is subscribed to
+            key_header: Conflate on the value of this header instead of the subject. Messages without the
+                header fall back to their subject
+            max_keys: The most keys that can be pending at once. When full, the oldest pending key is dropped
+        """
+        self.subject = subject
+        self.key_header = key_header
+        self.max_keys = max_keys
+        # Set by NATSClient when the mailbox is subscribed, with the mailbox as the subscription's callback
+        self.sid: Optional[int] = None
+
+        self.received = 0
+        self.delivered = 0
+        self.conflated = 0
+        self.dropped = 0
+        # Only the `max_keys` most recently conflated keys are counted, so this stays bounded however many keys pass
+        self.conflated_by_key: OrderedDict[str, int] = OrderedDict()
+
+        self.__pending: OrderedDict[str, Message] = OrderedDict()
+        self.__cond = threading.Condition()
+        self._logger = logging.getLogger("pynats.mailbox")
+
+    def __len__(self) -> int:
+        with self.__cond:
+            return len(self.__pending)
+
+    def __call__(self, msg: Message) -> None:
+        self.put(msg)
+
+    def key(self, msg: Message) -> str:
+        if self.key_header is not None:
+            header = getattr(msg, "header", None)
+            if header and self.key_header in header:
+                return header[self.key_header]
+        return msg.subject
+
+    def put(self, msg: Message) -> None:
+        key = self.key(msg)
+        with self.__cond:
+            self.received += 1
+            if key in self.__pending:
+                self.conflated += 1
+                self.conflated_by_key[key] = self.conflated_by_key.get(key, 0) + 1
+                self.conflated_by_key.move_to_end(key)
+                if len(self.conflated_by_key) > self.max_keys:
+                    self.conflated_by_key.popitem(last=False)
+            elif len(self.__pending) >= self.max_keys:
+                dropped_key, _ = self.__pending.popitem(last=False)
+                self.dropped += 1
+                self._logger.debug("Mailbox for %s is full, dropped pending key %s", self.subject, dropped_key)
+            # Overwriting keeps the key's place in line
+            self.__pending[key] = msg
+            self.__cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Message]:
+        """Get the newest message for the key that has been pending longest. Blocks for up to `timeout` seconds
+        (forever if None) and returns None if nothing arrived.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            while not self.__pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.__cond.wait(remaining)
+            _, msg = self.__pending.popitem(last=False)
+            self.delivered += 1
+            return msg
+
+    def drain(self) -> List[Message]:
+        """Take every pending message at once, oldest key first"""
+        with self.__cond:
+            msgs = list(self.__pending.values())
+            self.__pending.clear()
+            self.delivered += len(msgs)
+            return msgs
+
+    def stats(self) -> Dict[str, int]:
+        with self.__cond:
+            return {
+                "pending": len(self.__pending),
+                "received": self.received,
+                "delivered": self.delivered,
+                "conflated": self.conflated,
+                "dropped": self.dropped,
+            }
@@ -3,19 +3,41 @@
 import contextlib
 import itertools
 import logging
-import ssl
+import os
+import time
 from dataclasses import dataclass, field
 from queue import Empty
-from threading import Event, Lock, Thread
-from typing import Callable, Dict, Optional
-from uuid import uuid4
+from threading import Event, RLock, Thread
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 import pynats.protocol.wire as wire
+from pynats.protocol.subscriptions import SubscriptionTable
 from pynats.transport import Transport
 
+if TYPE_CHECKING:
+    # Only needed by clients that use them, so they aren't imported up front
+    import ssl
+
+    from pynats.codec import CodecRegistry
+    from pynats.dedup import DedupFilter
+    from pynats.ratelimit import RateLimiter
+    from pynats.tracing import LatencyTracer
+    from pynats.watchdog import CallbackWatchdog
+
+# subMany/unsubMany queue their frames in chunks of about this size
+SUB_BATCH_BYTES = 64 * 1024
+
 
 def createSubId() -> str:
-    return str(uuid4()).split("-")[0]
+    return os.urandom(4).hex()
+
+
+def createInbox() -> str:
+    return f"_INBOX.{os.urandom(16).hex()}"
+
+
+def createMsgId() -> str:
+    return os.urandom(16).hex()
 
 
 @dataclass
@@ -66,8 +88,10 @@ class Protocol(Thread):
         user: Optional[str] = "",
         password: Optional[str] = "",
         auth_token: Optional[str] = "",
-        tls: Optional[ssl.SSLContext] = None,
+        tls: Optional["ssl.SSLContext"] = None,
         connected: Optional[Event] = None,
+        no_echo: bool = False,
+        local_delivery: bool = False,
     ) -> None:
         super().__init__()
         self.transport = transport
@@ -76,13 +100,37 @@ class Protocol(Thread):
         self.auth_token = auth_token
         self.tls = tls
         self.got_connect = connected
+        # Why the connection couldn't be brought up, if it couldn't. Set before `connected` is
+        self.connect_error: Optional[Exception] = None
+        # Local delivery only works if the server doesn't also echo the message back
+        self.local_delivery = local_delivery
+        self.no_echo = no_echo or local_delivery
+        self.local_deliveries = 0
+        # Set when a publish rate limit is configured
+        self.rate_limiter: Optional["RateLimiter"] = None
+        # Set to give messages a codec to lazily decode their payload with
+        self.codecs: Optional["CodecRegistry"] = None
+        # Set to drop messages with a Nats-Msg-Id that was already seen
+        self.dedup: Optional["DedupFilter"] = None
+        # Set to time callbacks and report slow ones
+        self.watchdog: Optional["CallbackWatchdog"] = None
+        # Set to record the latency of received messages that carry a trace timestamp
+        self.tracer: Optional["LatencyTracer"] = None
+        # Set to share built CONNECT frames between clients, keyed by their options
+        self.connect_frames: Optional[Dict[tuple, bytes]] = None
         self.__close_event = Event()
+        # perf_counter() of when CONNECT was queued, until the server acknowledges it
+        self.__connect_sent: Optional[float] = None
         self._logger = logging.getLogger("pynats.protocol.nats")
-        if not isinstance(tls, ssl.SSLContext):
-            self._logger.warning(
-                "'tls' argument should be an ssl.SSLContext to use to upgrade the socket. Setting 'tls' to None"
-            )
-            self.tls = None
+        if tls is not None:
+            # Only imported here, since ssl is slow to import and plain TCP clients don't need it
+            import ssl
+
+            if not isinstance(tls, ssl.SSLContext):
+                self._logger.warning(
+                    "'tls' argument should be an ssl.SSLContext to use to upgrade the socket. Setting 'tls' to None"
+                )
+                self.tls = None
 
         # Params from the server
         self.info_options: InfoOptions = None
@@ -97,18 +145,27 @@ class Protocol(Thread):
             b"ERR": self.handleProtocolErr,
         }
 
-        # Map of subject to sub id
-        self.subscriptions: dict[str, str] = {}
+        self.subscriptions = SubscriptionTable()
 
-        # Empty string key is the catch all
+        # Empty string key is the catch all. Reentrant so a callback can publish to a locally delivered subject
         self.callbacks: Dict[str : Dict[str, Callable]] = {"": {}}
-        self.callbacks_lock = Lock()
+        # Callbacks that only get the messages delivered to one subscription, keyed by its sid as it comes off the wire
+        self.sid_callbacks: Dict[str, Callable] = {}
+        self.callbacks_lock = RLock()
 
     def close(self):
         self.__close_event.set()
 
     def run(self):
-        self.transport.start()
+        try:
+            self.transport.start()
+        except OSError as e:
+            self.__failConnect(e)
+            if self.rate_limiter is not None:
+                self.rate_limiter.close()
+            return
+        if self.watchdog is not None:
+            self.watchdog.start()
 
         exit_loop = self.__close_event.is_set
         getMsg = self.transport.recv_queue.get
@@ -126,40 +183,129 @@ class Protocol(Thread):
                 self.protocol_handlers[data._type](data)
 
         self._logger.info("Ending NATS Protocol")
+        if self.rate_limiter is not None:
+            self.rate_limiter.close()
+        if self.watchdog is not None:
+            self.watchdog.close()
         self.transport.close()
 
-    def send(self, subject: str, payload: bytes, headers: dict, reply_to: str) -> None:
+    def send(self, subject: str, payload: bytes, headers: dict, reply_to: str) -> bool:
         msg_b = (
             wire.buildPub(subject, payload, reply_to)
             if not headers
             else wire.buildHpub(subject, payload, headers, reply_to)
         )
         self._logger.debug("Queueing (H)PUB")
-        self.transport.send_queue.put(msg_b)
-
-    def sub(self, subject: str, queue_group: str = None) -> bool:
-        if subject in self.subscriptions:
+        if self.rate_limiter is None:
+            self.transport.send_queue.put(msg_b)
+        elif not self.rate_limiter.submit(subject, msg_b, self.transport.send_queue.put):
             return False
+        if self.local_delivery:
+            self.deliverLocal(subject, payload, headers, reply_to)
+        return True
 
-        sid = createSubId()
+    def sendBatch(self, messages: Iterable[Tuple[str, bytes]]) -> None:
+        """Queue several PUBs as a single write. Not rate limited, since it's meant for protocol traffic like acks"""
+        batch_b = b"".join(wire.buildPub(subject, payload, None) for subject, payload in messages)
+        if batch_b:
+            self.transport.send_queue.put(batch_b)
+
+    def deliverLocal(self, subject: str, payload: bytes, headers: dict, reply_to: str) -> int:
+        """Dispatch a published message to this client's own matching subscriptions without the server echoing it
+        back. Like the server, this delivers once per matching subscription. Returns the number of deliveries.
+
+        Callbacks are run on the calling (publishing) thread rather than the protocol thread.
+        """
+        delivered = 0
+        for sid in self.subscriptions.matching(subject):
+            sid = str(sid)
+            if headers:
+                msg = wire.HmsgMessage(b"HMSG", subject, sid, dict(headers), payload, reply_to or "")
+            else:
+                msg = wire.MsgMessage(b"MSG", subject, sid, payload, reply_to or "")
+            self._logger.debug("Delivering %s locally to sid %s", subject, sid)
+            self.protocol_handlers[msg._type](msg)
+            delivered += 1
+        self.local_deliveries += delivered
+        return delivered
+
+    def sub(self, subject: str, queue_group: str = None, callback: Callable = None) -> int:
+        """Subscribe to `subject`, returning the sid. `callback` is bound to this subscription, getting only the
+        messages delivered to it, until it's unsubscribed
+        """
+        sid = self.subscriptions.add(subject, queue_group)
+        if callback is not None:
+            with self.callbacks_lock:
+                self.sid_callbacks[str(sid)] = callback
         sub_b = wire.buildSub(subject, sid, queue_group)
         self._logger.debug("Subbing to %s with sid %s", subject, sid)
         self.transport.send_queue.put(sub_b, timeout=0.1)
-        self.subscriptions[subject] = sid
-        return True
-
-    def unsub(self, subject: str, max_msgs: int = None) -> bool:
-        sid = self.subscriptions.pop(subject, None)
-        if sid is None:
+        return sid
+
+    def subMany(self, subjects: Iterable[str], queue_group: str = None) -> List[int]:
+        """Subscribe to many subjects, queueing the SUB frames in large batches rather than one at a time"""
+        sids = []
+        batch_b = bytearray()
+        for subject in subjects:
+            sid = self.subscriptions.add(subject, queue_group)
+            sids.append(sid)
+            batch_b += wire.buildSub(subject, sid, queue_group)
+            if len(batch_b) >= SUB_BATCH_BYTES:
+                self.transport.send_queue.put(bytes(batch_b))
+                batch_b.clear()
+        if batch_b:
+            self.transport.send_queue.put(bytes(batch_b))
+        self._logger.debug("Subbed to %s subjects", len(sids))
+        return sids
+
+    def unsub(self, subject: str, max_msgs: int = None, sid: int = None) -> bool:
+        """Unsubscribe from every subscription to `subject`, or only the one with `sid`"""
+        sids = self.subscriptions.sids(subject) if sid is None else (sid,)
+        unsub_b = b""
+        for sub_sid in sids:
+            if self.subscriptions.remove(sub_sid) is None:
+                continue
+            self.__unbindCallback(sub_sid)
+            self._logger.debug("Unsubbing from %s (id %s)", subject, sub_sid)
+            unsub_b += wire.buildUnsub(sub_sid, max_msgs)
+        if not unsub_b:
             return False
 
-        self._logger.debug("Unsubbing from %s (id %s)", subject, sid)
+        self.__warnOrphanedCallbacks(subject)
+        self.transport.send_queue.put(unsub_b)
+        return True
+
+    def unsubMany(self, subjects: Iterable[str]) -> int:
+        """Unsubscribe from many subjects in large batches. Returns how many subscriptions were removed"""
+        removed = 0
+        batch_b = bytearray()
+        for subject in subjects:
+            for sid in self.subscriptions.sids(subject):
+                if self.subscriptions.remove(sid) is None:
+                    continue
+                self.__unbindCallback(sid)
+                removed += 1
+                batch_b += wire.buildUnsub(sid)
+            self.__warnOrphanedCallbacks(subject)
+            if len(batch_b) >= SUB_BATCH_BYTES:
+                self.transport.send_queue.put(bytes(batch_b))
+                batch_b.clear()
+        if batch_b:
+            self.transport.send_queue.put(bytes(batch_b))
+        self._logger.debug("Unsubbed from %s subscriptions", removed)
+        return removed
+
+    def __unbindCallback(self, sid: int) -> None:
+        if self.sid_callbacks:
+            with self.callbacks_lock:
+                self.sid_callbacks.pop(str(sid), None)
+
+    def __warnOrphanedCallbacks(self, subject: str) -> None:
+        if subject in self.subscriptions:
+            return
         with self.callbacks_lock:
             if subject in self.callbacks and self.callbacks[subject]:
                 self._logger.warning("Unsubbing from %s, but there are still callbacks for it", subject)
-        unsub_b = wire.buildUnsub(sid, max_msgs)
-        self.transport.send_queue.put(unsub_b)
-        return True
 
     def addCB(self, callback: Callable, subject: str = "") -> str:
         str_subject = str(subject)
@@ -188,6 +334,8 @@ class Protocol(Thread):
     # Protocol type handlers
     # ---------------------------
     def handleProtocolInfo(self, msg: wire.InfoMessage) -> None:
+        timings = self.transport.timings
+        timings.info = time.perf_counter() - self.transport.connected_at
         self.info_options = InfoOptions.build(msg.options)
         connect_options = {
             "lang": "py",
@@ -197,6 +345,11 @@ class Protocol(Thread):
             "tls_required": self.tls is not None,
             "headers": True,
         }
+        if self.no_echo:
+            if self.info_options.proto is not None and self.info_options.proto < 1:
+                self._logger.warning("Server protocol version doesn't support no_echo, own messages will be echoed")
+            else:
+                connect_options["echo"] = False
         # Verify some info
         if self.info_options.auth_required:
             if self.user and self.password:
@@ -209,14 +362,31 @@ class Protocol(Thread):
 
         if self.info_options.tls_required:
             if self.tls is None:
-                raise RuntimeError("Server indicated TLS is required and not SSL Context was provided")
-            self.transport.wrap_socket(self.tls)
-
-        connect_wire: bytes = wire.build_connect(connect_options)
+                self.__failConnect(RuntimeError("Server indicated TLS is required and not SSL Context was provided"))
+                return
+            try:
+                self.transport.wrap_socket(self.tls)
+            except OSError as e:
+                self.__failConnect(e)
+                return
+
+        connect_key = tuple(connect_options.items())
+        connect_wire = self.connect_frames.get(connect_key) if self.connect_frames is not None else None
+        if connect_wire is None:
+            connect_wire = wire.build_connect(connect_options)
+            if self.connect_frames is not None:
+                self.connect_frames[connect_key] = connect_wire
         self._logger.debug("Sending connect")
+        self.__connect_sent = time.perf_counter()
         self.transport.send_queue.put(connect_wire)
         self.got_connect.set()
 
+    def __failConnect(self, error: Exception) -> None:
+        self._logger.error("Couldn't connect: %s", error)
+        self.connect_error = error
+        self.close()
+        self.got_connect.set()
+
     def handleProtocolPing(self, _) -> None:
         self._logger.debug("Received PING, sending PONG")
         pong_msg = wire.build_pong()
@@ -224,24 +394,63 @@ class Protocol(Thread):
 
     def handleProtocolMsg(self, msg: wire.MsgMessage) -> None:
         self._logger.debug("Received MSG")
-        with self.callbacks_lock:
-            [
-                cb(msg)
-                for cb in [*self.callbacks.get(msg.subject, {}).values(), *self.callbacks[""].values()]
-                if cb is not None
-            ]
+        self.__dispatch(msg)
 
     def handleProtocolHmsg(self, msg: wire.HmsgMessage) -> None:
         self._logger.debug("Received HMSG")
+        # JetStream already dedups on publish, and a redelivery (e.g. after a NAK) keeps the message's id
+        if (
+            self.dedup is not None
+            and not msg.reply_to.startswith(wire.JS_ACK_PREFIX)
+            and self.dedup.isDuplicate(msg.header.get(wire.MSG_ID_HEADER), msg.sid)
+        ):
+            self._logger.debug("Dropping duplicate message %s on %s", msg.header[wire.MSG_ID_HEADER], msg.subject)
+            return
+        if self.tracer is None or not msg.parsed_at:
+            self.__dispatch(msg)
+            return
+        dispatched_at = time.time_ns()
+        self.__dispatch(msg)
+        self.tracer.record(msg.subject, msg.header, msg.parsed_at, dispatched_at, time.time_ns())
+
+    def __dispatch(self, msg: Union[wire.MsgMessage, wire.HmsgMessage]) -> None:
+        if self.codecs is not None:
+            msg.codec = self.codecs.codecFor(msg.subject)
+        sub_subject, primary = self.subscriptions.lookup(msg.sid)
         with self.callbacks_lock:
-            [
-                cb(msg)
-                for cb in [*self.callbacks.get(msg.subject, {}).values(), *self.callbacks[""].values()]
-                if cb is not None
-            ]
+            bound = self.sid_callbacks.get(msg.sid)
+            callbacks = [(msg.sid, bound)] if bound is not None else []
+            # A subject's callbacks run once per message, not once per copy, however often it's subscribed to
+            if primary or sub_subject is None:
+                callbacks.extend(self.callbacks.get(msg.subject, {}).items())
+                # Callbacks added on a wildcard subscription's subject are found through the sid of the message
+                if sub_subject is not None and sub_subject != msg.subject:
+                    callbacks.extend(self.callbacks.get(sub_subject, {}).items())
+            callbacks.extend(self.callbacks[""].items())
+            watchdog = self.watchdog
+            for callback_id, cb in callbacks:
+                if cb is None:
+                    continue
+                if watchdog is None:
+                    cb(msg)
+                    continue
+                invocation = watchdog.begin(callback_id, msg.subject)
+                try:
+                    cb(msg)
+                finally:
+                    watchdog.end(invocation)
 
     def handleProtocolOk(self, _: wire.Message) -> None:
         self._logger.debug("Got +OK")
+        self.__ackConnect()
 
     def handleProtocolErr(self, msg: wire.ErrMessage) -> None:
         self._logger.debug("Got -ERR: %s", msg.error_message)
+        self.__ackConnect()
+
+    def __ackConnect(self) -> None:
+        if self.__connect_sent is None:
+            return
+        self.transport.timings.connect = time.perf_counter() - self.__connect_sent
+        self.__connect_sent = None
+        self._logger.debug("Connect timings: %s", self.transport.timings)
@@ -0,0 +1,156 @@
+"""Compact table of the client's subscriptions, keyed by integer sid"""
+
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import pynats.protocol.wire as wire
+
+# Dead slots at the front of the table are trimmed once there are this many
+_TRIM_THRESHOLD = 1024
+
+
+class SubscriptionTable:
+    def __init__(self) -> None:
+        """Subscriptions are stored in lists indexed by sid, which count up from 1 and are never reused (so a late
+        message for an old subscription can't reach a new one). A subject can be subscribed to more than once,
+        e.g. with different queue groups. Removed entries leave a None until the front of the table is trimmed.
+        """
+        # Sid of the first slot in the lists
+        self.__base_sid = 1
+        self.__next_sid = 1
+        self.__subjects: List[Optional[str]] = []
+        self.__queue_groups: List[Optional[str]] = []
+        # Index of the first slot that might still be live
+        self.__front = 0
+        # Subject to its sid, or a tuple of sids if it's subscribed to more than once
+        self.__by_subject: Dict[str, Union[int, Tuple[int, ...]]] = {}
+        # Wildcard subscriptions, which have to be matched one by one
+        self.__wildcards: Dict[int, str] = {}
+        self.__count = 0
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __contains__(self, subject: str) -> bool:
+        return subject in self.__by_subject
+
+    def add(self, subject: str, queue_group: Optional[str] = None) -> int:
+        with self.__lock:
+            sid = self.__next_sid
+            self.__next_sid += 1
+            self.__subjects.append(subject)
+            self.__queue_groups.append(queue_group or None)
+            existing = self.__by_subject.get(subject)
+            if existing is None:
+                self.__by_subject[subject] = sid
+            elif isinstance(existing, int):
+                self.__by_subject[subject] = (existing, sid)
+            else:
+                self.__by_subject[subject] = (*existing, sid)
+            if "*" in subject or ">" in subject:
+                self.__wildcards[sid] = subject
+            self.__count += 1
+            return sid
+
+    def remove(self, sid: Union[int, str]) -> Optional[str]:
+        """Remove a subscription, returning its subject (None if there was no such subscription)"""
+        with self.__lock:
+            index = self.__index(sid)
+            if index is None:
+                return None
+            sid = index + self.__base_sid
+            subject = self.__subjects[index]
+            self.__subjects[index] = None
+            self.__queue_groups[index] = None
+            self.__wildcards.pop(sid, None)
+            existing = self.__by_subject[subject]
+            if isinstance(existing, int):
+                del self.__by_subject[subject]
+            else:
+                remaining = tuple(other for other in existing if other != sid)
+                self.__by_subject[subject] = remaining[0] if len(remaining) == 1 else remaining
+            self.__count -= 1
+            self.__trim()
+            return subject
+
+    def __trim(self) -> None:
+        subjects = self.__subjects
+        while self.__front < len(subjects) and subjects[self.__front] is None:
+            self.__front += 1
+        dead = self.__front
+        if dead >= _TRIM_THRESHOLD or (dead and dead == len(subjects)):
+            del subjects[:dead]
+            del self.__queue_groups[:dead]
+            self.__base_sid += dead
+            self.__front = 0
+
+    def __index(self, sid: Union[int, str]) -> Optional[int]:
+        try:
+            index = int(sid) - self.__base_sid
+        except ValueError:
+            return None
+        if index < 0 or index >= len(self.__subjects) or self.__subjects[index] is None:
+            return None
+        return index
+
+    # Readers take the lock too, since trimming moves the lists and the base sid in separate steps
+    def subject(self, sid: Union[int, str]) -> Optional[str]:
+        """The subject subscribed to with `sid`. Accepts the sid as a string, as it comes off the wire"""
+        with self.__lock:
+            index = self.__index(sid)
+            return self.__subjects[index] if index is not None else None
+
+    def queueGroup(self, sid: Union[int, str]) -> Optional[str]:
+        with self.__lock:
+            index = self.__index(sid)
+            return self.__queue_groups[index] if index is not None else None
+
+    def lookup(self, sid: Union[int, str]) -> Tuple[Optional[str], bool]:
+        """The subject subscribed to with `sid` (None if there's no such subscription), and whether it's the
+        subscription that the subject's callbacks run for. The server sends a copy of each message to every
+        subscription, so a subject that is subscribed to more than once picks one: its first subscription outside a
+        queue group, which gets every message, or its first subscription if they are all in queue groups
+        """
+        with self.__lock:
+            index = self.__index(sid)
+            if index is None:
+                return None, False
+            subject = self.__subjects[index]
+            sids = self.__sids(subject)
+            if len(sids) == 1:
+                return subject, True
+            sid = index + self.__base_sid
+            primary = next((other for other in sids if self.__queue_groups[other - self.__base_sid] is None), sids[0])
+            return subject, sid == primary
+
+    def sids(self, subject: str) -> Tuple[int, ...]:
+        with self.__lock:
+            return self.__sids(subject)
+
+    def __sids(self, subject: str) -> Tuple[int, ...]:
+        existing = self.__by_subject.get(subject, ())
+        return (existing,) if isinstance(existing, int) else existing
+
+    def matching(self, subject: str, include_queue_groups: bool = False) -> List[int]:
+        """Sids of the subscriptions a message published on `subject` would be delivered to"""
+        with self.__lock:
+            sids = [*self.__sids(subject)]
+            sids.extend(
+                sid
+                for sid, pattern in self.__wildcards.items()
+                if pattern != subject and wire.subjectMatches(pattern, subject)
+            )
+            if not include_queue_groups:
+                sids = [sid for sid in sids if self.__queue_groups[sid - self.__base_sid] is None]
+            return sids
+
+    def items(self) -> Iterator[Tuple[int, str, Optional[str]]]:
+        """(sid, subject, queue group) of every subscription"""
+        with self.__lock:
+            subjects = list(self.__subjects)
+            queue_groups = list(self.__queue_groups)
+            base_sid = self.__base_sid
+        for index, subject in enumerate(subjects):
+            if subject is not None:
+                yield index + base_sid, subject, queue_groups[index]
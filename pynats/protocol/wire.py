@@ -4,7 +4,8 @@ import dataclasses
 import json
 import logging
 import re
-from typing import Union
+import time
+from typing import Optional, Tuple, Union
 
 _logger = logging.getLogger("pynats.protocol.wire")
 
@@ -24,6 +25,12 @@ MSG_TYPES = (
 )
 
 NEWLINE = "\r\n"
+MSG_ID_HEADER = "Nats-Msg-Id"
+# Reply subject prefix of messages delivered by a JetStream consumer
+JS_ACK_PREFIX = "$JS.ACK."
+# Added to traced messages: the publish time in hex nanoseconds since the epoch, and an id to follow the message by
+TRACE_TS_HEADER = "Pynats-Ts"
+TRACE_ID_HEADER = "Pynats-Trace-Id"
 B_NEWLINE = b"\r\n"
 B_MSG_DELIM = rb"[ \t]{1,}"
 B_MSG_JSON = rb"\{\"[a-zA-Z0-9\"'-_: ]{0,}\}"
@@ -34,15 +41,21 @@ RE_INFO_MSG = re.compile(
     rb"INFO[ \t]{1,}(?P<options>\{[a-zA-Z0-9\"'-_: ]{1,}\})[ \t]{1,}\r\n"
 )
 
-RE_MSG_BODY = re.compile(
-    rb"MSG[ \t]{1,}(?P<subject>[\w\.]{1,})[ \t]{1,}(?P<sid>[\w\.]{1,})[ \t]{1,}((?P<reply>[\w\.]{1,})[ \t]{1,}){0,1}(?P<numbytes>[0-9]{1,})\r\n(?P<payload>.{0,}){0,1}\r\n",
+RE_ERR_BODY = re.compile(rb"-ERR (?P<msg>.{1,})[ \t]{0,}\r\n", re.ASCII)
+
+# Control lines only. The payload is sliced out using the byte counts, so it can hold anything (including \r\n)
+# and a message split across socket reads is left in the buffer until the rest of it arrives
+RE_MSG_LINE = re.compile(
+    rb"MSG[ \t]{1,}(?P<subject>[^ \t\r\n]{1,})[ \t]{1,}(?P<sid>[^ \t\r\n]{1,})[ \t]{1,}"
+    rb"((?P<reply>[^ \t\r\n]{1,})[ \t]{1,}){0,1}(?P<numbytes>[0-9]{1,})[ \t]{0,}\r\n",
     re.ASCII,
 )
-RE_HMSG_BODY = re.compile(
-    rb"HMSG[ \t]{1,}(?P<subject>[\w\.]{1,})[ \t]{1,}(?P<sid>[\w\.]{1,})[ \t]{1,}((?P<reply>[\w\.]{1,})[ \t]{1,}){0,1}(?P<numhdrbytes>[0-9]{1,})[ \t]{1,}(?P<numbytes>[0-9]{1,})\r\nNATS/1\.0\r\n(?P<hdr>([\w.]{1,}: [\w.]{1,}\r\n){1,})\r\n(?P<payload>.{0,}){0,1}\r\n",
+RE_HMSG_LINE = re.compile(
+    rb"HMSG[ \t]{1,}(?P<subject>[^ \t\r\n]{1,})[ \t]{1,}(?P<sid>[^ \t\r\n]{1,})[ \t]{1,}"
+    rb"((?P<reply>[^ \t\r\n]{1,})[ \t]{1,}){0,1}(?P<numhdrbytes>[0-9]{1,})[ \t]{1,}"
+    rb"(?P<numbytes>[0-9]{1,})[ \t]{0,}\r\n",
     re.ASCII,
 )
-RE_ERR_BODY = re.compile(rb"-ERR (?P<msg>.{1,})[ \t]{0,}\r\n", re.ASCII)
 
 
 @dataclasses.dataclass
@@ -55,21 +68,41 @@ class InfoMessage(Message):
     options: dict
 
 
+class DecodedPayload:
+    """Gives a message a `data` attribute: the payload decoded by the subject's codec the first time it's read, or
+    the raw payload if there is no codec. Messages that are never read are never decoded.
+    """
+
+    @property
+    def data(self):
+        if "_data" not in self.__dict__:
+            codec = self.codec
+            self.__dict__["_data"] = self.payload if codec is None else codec.decode(memoryview(self.payload))
+        return self.__dict__["_data"]
+
+
 @dataclasses.dataclass
-class MsgMessage(Message):
+class MsgMessage(Message, DecodedPayload):
     subject: str
     sid: str
     payload: bytes
     reply_to: str = ""
+    codec: object = dataclasses.field(default=None, repr=False, compare=False)
 
 
 @dataclasses.dataclass
-class HmsgMessage(Message):
+class HmsgMessage(Message, DecodedPayload):
     subject: str
     sid: str
     header: dict
     payload: bytes
     reply_to: str = ""
+    # From the header version line, e.g. "NATS/1.0 404 No Messages"
+    status: str = ""
+    description: str = ""
+    codec: object = dataclasses.field(default=None, repr=False, compare=False)
+    # time.time_ns() of when a traced message was parsed, 0 for messages without a trace timestamp
+    parsed_at: int = dataclasses.field(default=0, repr=False, compare=False)
 
 
 @dataclasses.dataclass
@@ -77,6 +110,20 @@ class ErrMessage(Message):
     error_message: str
 
 
+def subjectMatches(pattern: str, subject: str) -> bool:
+    """Check if a subject matches a subscription subject, which may contain `*` and `>` wildcards"""
+    if pattern == subject:
+        return True
+    pattern_tokens = pattern.split(".")
+    subject_tokens = subject.split(".")
+    for i, token in enumerate(pattern_tokens):
+        if token == ">":
+            return len(subject_tokens) > i
+        if i >= len(subject_tokens) or (token != "*" and token != subject_tokens[i]):
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
 def parse_stream(buf: bytearray, putMsg):
     msg_type_match = RE_MESSAGE_TYPE.match(buf)
     if msg_type_match is None:
@@ -89,8 +136,10 @@ def parse_stream(buf: bytearray, putMsg):
     _logger.debug("Got %s message", msg_type)
     if msg_type == b"INFO":
         info_msg, byte_len = parse_info(buf)
+        if info_msg is None:
+            return 0
         putMsg(info_msg)
-        return byte_len if byte_len is not None else 0
+        return byte_len
     elif msg_type == b"+OK":
         putMsg(Message(b"OK"))
         return msg_type_match.end()
@@ -104,11 +153,13 @@ def parse_stream(buf: bytearray, putMsg):
         return msg_type_match.end()
     elif msg_type == b"MSG":
         msg, byte_len = parseMsg(buf)
-        putMsg(msg)
+        if msg is not None:
+            putMsg(msg)
         return byte_len
     elif msg_type == b"HMSG":
         msg, byte_len = parseHmsg(buf)
-        putMsg(msg)
+        if msg is not None:
+            putMsg(msg)
         return byte_len
 
 
@@ -170,7 +221,7 @@ def buildHpub(subject: str, payload: bytes, headers: dict, reply: str) -> bytes:
     return msg
 
 
-def buildSub(subject: str, sid: str, queue_group: str = None) -> bytes:
+def buildSub(subject: str, sid: Union[str, int], queue_group: str = None) -> bytes:
     msg = f"SUB {subject}".encode()
     if queue_group:
         msg += f" {queue_group}".encode()
@@ -179,7 +230,7 @@ def buildSub(subject: str, sid: str, queue_group: str = None) -> bytes:
     return msg
 
 
-def buildUnsub(sid: str, max_msgs: int = None) -> bytes:
+def buildUnsub(sid: Union[str, int], max_msgs: int = None) -> bytes:
     msg = f"UNSUB {sid}".encode()
     if max_msgs:
         msg += f" {max_msgs}".encode()
@@ -196,44 +247,61 @@ def parse_info_options(options: bytes) -> dict:
     return json.loads(options_text.group("options"))
 
 
-def parseMsg(buf: bytearray) -> dict:
-    parsed = RE_MSG_BODY.match(buf)
+def parseMsg(buf: bytearray) -> Tuple[Optional[MsgMessage], int]:
+    """Returns the message and the bytes it used, or (None, 0) if the whole message isn't in the buffer yet"""
+    parsed = RE_MSG_LINE.match(buf)
     if parsed is None:
-        return None
+        return None, 0
+
+    start = parsed.end()
+    end = start + int(parsed.group("numbytes"))
+    if len(buf) < end + 2:
+        return None, 0
 
     msg = MsgMessage(
         b"MSG",
         parsed.group("subject").decode(),
         parsed.group("sid").decode(),
-        parsed.group("payload"),
+        bytes(buf[start:end]),
     )
-    _ = int(parsed.group("numbytes").decode())
     reply_to = parsed.group("reply")
     if reply_to is not None:
-        msg.reply_to = reply_to
-    return msg, parsed.end()
+        msg.reply_to = reply_to.decode()
+    return msg, end + 2
 
 
-def parseHmsg(body: bytes) -> dict:
-    parsed = RE_HMSG_BODY.match(body)
+def parseHmsg(buf: bytearray) -> Tuple[Optional[HmsgMessage], int]:
+    """Returns the message and the bytes it used, or (None, 0) if the whole message isn't in the buffer yet"""
+    parsed = RE_HMSG_LINE.match(buf)
     if parsed is None:
-        return None
+        return None, 0
+
+    start = parsed.end()
+    hdr_end = start + int(parsed.group("numhdrbytes"))
+    end = start + int(parsed.group("numbytes"))
+    if len(buf) < end + 2:
+        return None, 0
 
     msg = HmsgMessage(
         b"HMSG",
         parsed.group("subject").decode(),
         parsed.group("sid").decode(),
         {},
-        parsed.group("payload"),
+        bytes(buf[hdr_end:end]),
     )
     reply_to = parsed.group("reply")
     if reply_to is not None:
-        msg.reply_to = reply_to
+        msg.reply_to = reply_to.decode()
 
-    hdrs = parsed.group("hdr")
-    for headers in hdrs.decode().split("\r\n"):
+    version, *hdrs = bytes(buf[start:hdr_end]).decode().split("\r\n")
+    # The version line can carry a status code and description, e.g. "NATS/1.0 408 Request Timeout"
+    _, _, status = version.partition(" ")
+    msg.status, _, msg.description = status.strip().partition(" ")
+    for headers in hdrs:
         if not headers:
             continue
-        k, v = headers.split(":")
+        k, v = headers.split(":", 1)
         msg.header.update({k.strip(): v.strip()})
-    return msg, parsed.end()
+    if TRACE_TS_HEADER in msg.header:
+        msg.parsed_at = time.time_ns()
+    return msg, end + 2
@@ -0,0 +1,195 @@
+"""Token bucket rate limiting for publishes"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+# What to do with a publish that is over its limit
+BLOCK = "block"
+QUEUE = "queue"
+FAIL = "fail"
+POLICIES = (BLOCK, QUEUE, FAIL)
+
+
+@dataclass
+class RateLimit:
+    """Limits in messages and bytes per second. 0 means unlimited. Bursts default to one second's worth"""
+
+    msgs_per_sec: float = 0
+    bytes_per_sec: float = 0
+    burst_msgs: Optional[float] = None
+    burst_bytes: Optional[float] = None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def __refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, n: float, now: float) -> float:
+        """Seconds until `n` tokens are available. Anything bigger than the bucket only waits for a full bucket"""
+        self.__refill(now)
+        missing = min(n, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, n: float, now: float) -> None:
+        """Take `n` tokens. The balance can go negative, which reserves tokens that haven't been refilled yet"""
+        self.__refill(now)
+        self.tokens -= n
+
+
+class RateLimiter:
+    def __init__(self, limit: Optional[RateLimit] = None, policy: str = BLOCK, max_queued: int = 10000) -> None:
+        """Smooth publishes to a per-client limit plus optional limits for subject prefixes
+
+        Inputs:
+            limit: The limit for everything published by the client
+            policy: What to do with an over-limit publish. "block" sleeps the publishing thread until it fits,
+                "queue" hands it to a pacing thread and returns straight away, "fail" drops it and returns False
+            max_queued: The most publishes the "queue" policy will hold before rejecting more
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Rate limit policy must be one of {POLICIES}")
+        self.policy = policy
+        self.max_queued = max_queued
+        self.__client_buckets = self.__buildBuckets(limit)
+        # Longest prefix first, so the most specific limit is found first
+        self.__prefix_buckets: List[Tuple[str, List[Tuple[TokenBucket, bool]]]] = []
+        self.__lock = threading.Lock()
+
+        self.allowed = 0
+        self.delayed = 0
+        self.queued = 0
+        self.rejected = 0
+        self.total_delay = 0.0
+
+        # Pacing thread for the "queue" policy, started on first use
+        self.__heap: List[Tuple[float, int, bytes, Callable]] = []
+        self.__seq = itertools.count()
+        self.__last_due = 0.0
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__pacer: threading.Thread = None
+        self._logger = logging.getLogger("pynats.ratelimit")
+
+    @staticmethod
+    def __buildBuckets(limit: Optional[RateLimit]) -> List[Tuple[TokenBucket, bool]]:
+        """Buckets paired with whether they count bytes (True) or messages (False)"""
+        if limit is None:
+            return []
+        buckets = []
+        if limit.msgs_per_sec:
+            buckets.append((TokenBucket(limit.msgs_per_sec, limit.burst_msgs), False))
+        if limit.bytes_per_sec:
+            buckets.append((TokenBucket(limit.bytes_per_sec, limit.burst_bytes), True))
+        return buckets
+
+    def setLimit(self, limit: Optional[RateLimit]) -> None:
+        with self.__lock:
+            self.__client_buckets = self.__buildBuckets(limit)
+
+    def setSubjectLimit(self, prefix: str, limit: Optional[RateLimit]) -> None:
+        """Limit publishes to subjects starting with `prefix`, on top of the client limit. None removes it"""
+        with self.__lock:
+            self.__prefix_buckets = [entry for entry in self.__prefix_buckets if entry[0] != prefix]
+            if limit is not None:
+                self.__prefix_buckets.append((prefix, self.__buildBuckets(limit)))
+                self.__prefix_buckets.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+    def __reserve(self, subject: str, num_bytes: int, fail_fast: bool) -> Optional[float]:
+        """Reserve tokens for a publish. Returns how long it has to wait, or None if it was rejected"""
+        buckets = list(self.__client_buckets)
+        for prefix, prefix_buckets in self.__prefix_buckets:
+            if subject.startswith(prefix):
+                buckets.extend(prefix_buckets)
+                break
+
+        now = time.monotonic()
+        wait = max((bucket.delay(num_bytes if is_bytes else 1, now) for bucket, is_bytes in buckets), default=0.0)
+        if wait and fail_fast:
+            self.rejected += 1
+            return None
+        for bucket, is_bytes in buckets:
+            bucket.consume(num_bytes if is_bytes else 1, now)
+        self.allowed += 1
+        if wait:
+            self.delayed += 1
+            self.total_delay += wait
+        return wait
+
+    def submit(self, subject: str, data: bytes, put: Callable[[bytes], None]) -> bool:
+        """Pass `data` to `put` once it fits in the limits, following the policy. Returns False if it was rejected"""
+        with self.__lock:
+            if self.policy == QUEUE:
+                with self.__cond:
+                    backlog = len(self.__heap)
+                if backlog >= self.max_queued:
+                    self.rejected += 1
+                    return False
+            wait = self.__reserve(subject, len(data), self.policy == FAIL)
+        if wait is None:
+            self._logger.debug("Rate limit rejected publish to %s", subject)
+            return False
+
+        if self.policy == QUEUE:
+            with self.__cond:
+                # Anything already waiting goes first, so queued publishes keep their order
+                if wait or self.__heap:
+                    self.queued += 1
+                    self.__startPacer()
+                    self.__last_due = max(time.monotonic() + wait, self.__last_due)
+                    heapq.heappush(self.__heap, (self.__last_due, next(self.__seq), data, put))
+                    self.__cond.notify()
+                    return True
+        elif wait:
+            time.sleep(wait)
+        put(data)
+        return True
+
+    def __startPacer(self) -> None:
+        if self.__pacer is None:
+            self.__pacer = threading.Thread(target=self.__thread_pace, daemon=True)
+            self.__pacer.start()
+
+    def __thread_pace(self) -> None:
+        while True:
+            with self.__cond:
+                while not self.__closed and (not self.__heap or self.__heap[0][0] > time.monotonic()):
+                    self.__cond.wait(self.__heap[0][0] - time.monotonic() if self.__heap else None)
+                if self.__closed:
+                    return
+                _, _, data, put = heapq.heappop(self.__heap)
+                # Still holding the lock, so nothing submitted meanwhile can overtake this one
+                put(data)
+
+    def close(self) -> None:
+        with self.__cond:
+            self.__closed = True
+            if self.__heap:
+                self._logger.warning("Dropping %s rate limited publishes that were still queued", len(self.__heap))
+                self.__heap.clear()
+            self.__cond.notify()
+        if self.__pacer is not None:
+            self.__pacer.join()
+
+    def stats(self) -> Dict[str, float]:
+        with self.__cond:
+            pending = len(self.__heap)
+        return {
+            "allowed": self.allowed,
+            "delayed": self.delayed,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "pending": pending,
+            "total_delay": self.total_delay,
+        }
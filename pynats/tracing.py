@@ -0,0 +1,193 @@
+"""End to end latency tracing through publish timestamp headers"""
+
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pynats.protocol.wire as wire
+
+PUBLISH_TO_PARSE = "publish_to_parse"
+PARSE_TO_DISPATCH = "parse_to_dispatch"
+DISPATCH_TO_COMPLETE = "dispatch_to_complete"
+STAGES = (PUBLISH_TO_PARSE, PARSE_TO_DISPATCH, DISPATCH_TO_COMPLETE)
+
+# Values below this are counted exactly. Above it, each power of two range is split into half as many buckets
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_HALF_BUCKETS = _SUB_BUCKETS >> 1
+
+
+class LatencyHistogram:
+    """Log-linear histogram of nanosecond latencies, in the style of HdrHistogram
+
+    Values below 32ns are counted exactly and larger ones to within 1/16th, using a few hundred counters no
+    matter how many values are recorded. Not thread safe on its own.
+    """
+
+    def __init__(self) -> None:
+        self.counts: List[int] = []
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def bucketFor(value: int) -> int:
+        if value < _SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - _SUB_BUCKET_BITS
+        return _SUB_BUCKETS + (shift - 1) * _HALF_BUCKETS + (value >> shift) - _HALF_BUCKETS
+
+    @staticmethod
+    def highestEquivalent(bucket: int) -> int:
+        """The largest value counted in `bucket`"""
+        if bucket < _SUB_BUCKETS:
+            return bucket
+        shift, top = divmod(bucket - _SUB_BUCKETS, _HALF_BUCKETS)
+        shift += 1
+        return ((top + _HALF_BUCKETS + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        # Clocks on different hosts can disagree, which can make a latency come out negative
+        value = max(int(value), 0)
+        bucket = self.bucketFor(value)
+        if bucket >= len(self.counts):
+            self.counts.extend([0] * (bucket + 1 - len(self.counts)))
+        self.counts[bucket] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if not other.count:
+            return
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for bucket, count in enumerate(other.counts):
+            self.counts[bucket] += count
+        self.min = other.min if not self.count else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent: float) -> int:
+        if not self.count:
+            return 0
+        wanted = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self.highestEquivalent(bucket), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Count, then mean, min, percentiles and max in seconds"""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1e9 if self.count else 0.0,
+            "min": self.min / 1e9,
+            "p50": self.percentile(50) / 1e9,
+            "p90": self.percentile(90) / 1e9,
+            "p99": self.percentile(99) / 1e9,
+            "p999": self.percentile(99.9) / 1e9,
+            "max": self.max / 1e9,
+        }
+
+
+class LatencyTracer:
+    def __init__(self, sample_rate: float = 1.0, max_subjects: int = 1000) -> None:
+        """Stamps published messages with their publish time and a trace id, and records how long traced messages
+        took to reach this client, to be dispatched, and to be handled
+
+        Timestamps are wall clock time so they can be compared between hosts, which makes the publish to parse
+        latency only as accurate as the clocks are in sync.
+
+        Inputs:
+            sample_rate: The fraction of published messages that are stamped. Every stamped message that is
+                received is recorded
+            max_subjects: The most subjects histograms are kept for. Traced messages on further subjects are only
+                counted as dropped
+        """
+        self.sample_rate = sample_rate
+        self.max_subjects = max_subjects
+        self.stamped = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.__histograms: Dict[str, Tuple[LatencyHistogram, ...]] = {}
+        self.__lock = threading.Lock()
+        self._logger = logging.getLogger("pynats.tracing")
+
+    def stamp(self, header: Optional[dict]) -> Optional[dict]:
+        """Returns the headers to publish with, which include the trace headers if this message is sampled"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return header
+        self.stamped += 1
+        return {
+            **(header or {}),
+            wire.TRACE_TS_HEADER: format(time.time_ns(), "x"),
+            wire.TRACE_ID_HEADER: os.urandom(8).hex(),
+        }
+
+    def record(self, subject: str, header: dict, parsed_at: int, dispatched_at: int, completed_at: int) -> None:
+        """Record the stage latencies of a received message. Times are `time.time_ns()` values"""
+        try:
+            published_at = int(header[wire.TRACE_TS_HEADER], 16)
+        except (KeyError, ValueError):
+            self._logger.debug("Traced message on %s has no usable timestamp", subject)
+            return
+        with self.__lock:
+            histograms = self.__histograms.get(subject)
+            if histograms is None:
+                if len(self.__histograms) >= self.max_subjects:
+                    self.dropped += 1
+                    return
+                histograms = self.__histograms[subject] = tuple(LatencyHistogram() for _ in STAGES)
+            histograms[0].record(parsed_at - published_at)
+            histograms[1].record(dispatched_at - parsed_at)
+            histograms[2].record(completed_at - dispatched_at)
+            self.recorded += 1
+
+    def subjects(self) -> List[str]:
+        with self.__lock:
+            return sorted(self.__histograms)
+
+    def histogram(self, stage: str, subject: Optional[str] = None) -> LatencyHistogram:
+        """A copy of one stage's histogram for `subject`, or merged over every subject if it's None"""
+        index = STAGES.index(stage)
+        merged = LatencyHistogram()
+        with self.__lock:
+            if subject is not None:
+                histograms = [self.__histograms[subject]] if subject in self.__histograms else []
+            else:
+                histograms = self.__histograms.values()
+            for stage_histograms in histograms:
+                merged.merge(stage_histograms[index])
+        return merged
+
+    def report(self, subject: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """Latency summary of each stage for `subject`, or over every subject if it's None"""
+        return {stage: self.histogram(stage, subject).summary() for stage in STAGES}
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__histograms.clear()
+            self.stamped = 0
+            self.recorded = 0
+            self.dropped = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "stamped": self.stamped,
+                "recorded": self.recorded,
+                "dropped": self.dropped,
+                "subjects": len(self.__histograms),
+            }
@@ -6,45 +6,156 @@ import os
 import select
 import socket
 import threading
+import time
+from dataclasses import dataclass
 from queue import Empty, Full, Queue
-from ssl import SSLContext, SSLError
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
 import pynats.protocol.wire as wire
 
+if TYPE_CHECKING:
+    # ssl is slow to import, so it's only loaded once a connection is upgraded to TLS
+    from ssl import SSLContext, SSLSession
+
+
+@dataclass
+class ConnectTimings:
+    """Seconds spent in each phase of bringing a connection up
+
+    `connect` is the round trip from sending CONNECT to the server's first +OK/-ERR, so it is only filled
+    in once that reply has been handled. `first_publish` is from creating the client to its first publish being
+    queued, i.e. the cold start cost a short lived job pays before doing anything useful. For a client handed out
+    of a ConnectionFactory's warm pool it is from being handed out instead, so time spent waiting in the pool
+    isn't counted.
+    """
+
+    tcp: float = 0.0
+    info: float = 0.0
+    tls: float = 0.0
+    connect: float = 0.0
+    tls_resumed: bool = False
+    first_publish: float = 0.0
+
+
+class TLSSessionCache:
+    """Thread safe store of TLS sessions keyed by server address
+
+    Share one between clients (or keep it across restarts of a client) so later handshakes can resume the
+    session instead of doing a full handshake. A session is only handed back for the SSLContext that created it.
+    """
+
+    def __init__(self) -> None:
+        self.__sessions: Dict[Tuple[str, int], Tuple["SSLContext", "SSLSession"]] = {}
+        self.__lock = threading.Lock()
+
+    def get(self, host: str, port: int, ssl_context: "SSLContext") -> Optional["SSLSession"]:
+        with self.__lock:
+            entry = self.__sessions.get((host, port))
+        if entry is None or entry[0] is not ssl_context:
+            return None
+        return entry[1]
+
+    def put(self, host: str, port: int, ssl_context: "SSLContext", session: Optional["SSLSession"]) -> None:
+        if session is None:
+            return
+        with self.__lock:
+            self.__sessions[(host, port)] = (ssl_context, session)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__sessions.clear()
+
+
+# The send thread pulls queued frames into one write until it has at least this many bytes
+MAX_COALESCE_BYTES = 256 * 1024
+
+# Shared by every Transport that isn't given its own cache, so pooled clients resume each other's sessions
+DEFAULT_SESSION_CACHE = TLSSessionCache()
+
 
 class Transport:
-    def __init__(self, host: str, port: int, queue: Queue, send_queue: Queue) -> None:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        queue: Queue,
+        send_queue: Queue,
+        tls: Optional["SSLContext"] = None,
+        tls_first: bool = False,
+        connect_timeout: float = 2.0,
+        session_cache: Optional[TLSSessionCache] = None,
+        address: Optional[Tuple[str, int]] = None,
+    ) -> None:
         self.__socket: socket.socket = None
         self.__host = host
         self.__port = port
-        self.__close_pipe_r = os.pipe()
-        self.__close_pipe_w = os.pipe()
+        # Already resolved (ip, port) to connect to. `host` is still used to check the server's certificate
+        self.__address = address
+        self.__tls = tls
+        self.__is_tls = False
+        # Exceptions the reader treats as "no data yet". Filled in once the socket is wrapped with TLS
+        self.__want_read: Tuple[type, ...] = ()
+        self.__tls_first = tls_first and tls is not None
+        self.__connect_timeout = connect_timeout
+        self.__session_cache = session_cache if session_cache is not None else DEFAULT_SESSION_CACHE
+        # Pipes used to wake the I/O threads, created when the transport starts
+        self.__close_pipe_r: Tuple[int, int] = None
+        self.__close_pipe_w: Tuple[int, int] = None
         self.__exit_event = threading.Event()
 
+        # Used to park the I/O threads while the socket is upgraded to TLS
+        self.__upgrading = threading.Event()
+        self.__resume = threading.Event()
+        self.__parked = threading.Semaphore(0)
+
         self.__send_thread: threading.Thread = None
         self.__rcv_thread: threading.Thread = None
 
         self.recv_queue = queue
         self.send_queue = send_queue
+        self.timings = ConnectTimings()
+        # perf_counter() of when the transport was ready to read the server's INFO
+        self.connected_at = 0.0
         self._logger = logging.getLogger("pynats.transport")
 
+    @property
+    def is_tls(self) -> bool:
+        return self.__is_tls
+
     def start(self) -> None:
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__socket.settimeout(0.01)
-        self.__socket.connect((self.__host, self.__port))
-        self.__socket.setblocking(0)
+        start = time.perf_counter()
+        address = self.__address or (self.__host, self.__port)
+        self.__socket = socket.create_connection(address, timeout=self.__connect_timeout)
+        self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timings.tcp = time.perf_counter() - start
+
+        if self.__tls_first:
+            self._logger.debug("Doing TLS handshake before the server's INFO")
+            try:
+                self.__handshake(self.__tls)
+            except OSError:
+                self.__socket.close()
+                raise
+        self.__socket.setblocking(False)
+        self.connected_at = time.perf_counter()
 
+        self.__close_pipe_r = os.pipe()
+        self.__close_pipe_w = os.pipe()
         self.__start_readwrite_threads()
 
     def close(self):
         self._logger.debug("Setting exit event and writing to close pipes")
         self.__exit_event.set()
+        self.__resume.set()
         os.write(self.__close_pipe_r[1], b"x")
         os.write(self.__close_pipe_w[1], b"x")
         self.__rcv_thread.join()
         self.__send_thread.join()
+        self.__remember_session()
         self.__socket.shutdown(socket.SHUT_RDWR)
         self.__socket.close()
+        for fd in (*self.__close_pipe_r, *self.__close_pipe_w):
+            os.close(fd)
         self._logger.info("Closed transport")
 
     def __start_readwrite_threads(self) -> None:
@@ -55,28 +166,65 @@ class Transport:
         self.__send_thread = threading.Thread(target=self.__thread_sendbuf)
         self.__send_thread.start()
 
-    def wrap_socket(self, ssl_context: SSLContext):
-        self._logger.debug("Closing read and write threads to upgrade socket")
+    def wrap_socket(self, ssl_context: "SSLContext"):
+        """Upgrade the connected socket to TLS, parking the I/O threads for the duration of the handshake"""
+        if self.is_tls:
+            return
+
+        self._logger.debug("Parking read and write threads to upgrade socket")
+        self.__resume.clear()
+        self.__upgrading.set()
         os.write(self.__close_pipe_r[1], b"x")
         os.write(self.__close_pipe_w[1], b"x")
-        self.__rcv_thread.join()
-        self.__send_thread.join()
+        self.__parked.acquire()
+        self.__parked.acquire()
+        try:
+            self.__handshake(ssl_context)
+            self.__socket.setblocking(False)
+        finally:
+            self.__upgrading.clear()
+            self.__resume.set()
+        self._logger.debug("Resumed read and write threads post SSL upgrade")
+
+    def __handshake(self, ssl_context: "SSLContext") -> None:
+        """Raises the SSLError (or timeout) if the handshake fails, since the socket is unusable after that"""
+        from ssl import SSLWantReadError
+
+        session = self.__session_cache.get(self.__host, self.__port, ssl_context)
+        start = time.perf_counter()
         self.__socket = ssl_context.wrap_socket(
-            self.__socket, server_hostname=self.__host, do_handshake_on_connect=False
+            self.__socket, server_hostname=self.__host, do_handshake_on_connect=False, session=session
         )
+        self.__is_tls = True
+        self.__want_read = (SSLWantReadError,)
+        self.__socket.settimeout(self.__connect_timeout)
         try:
-            self.__socket.do_handshake(True)
-        except SSLError as e:
+            self.__socket.do_handshake()
+        except OSError as e:
             self._logger.error(f"SSL ERROR: {e}")
+            raise
+        self.timings.tls = time.perf_counter() - start
+        self.timings.tls_resumed = self.__socket.session_reused
+        self._logger.debug("TLS handshake took %.6fs (resumed: %s)", self.timings.tls, self.timings.tls_resumed)
+        self.__remember_session()
 
-        self.__close_pipe_r = os.pipe()
-        self.__close_pipe_w = os.pipe()
-        self._logger.debug("Restarting read and write threads post SSL upgrade")
-        self.__start_readwrite_threads()
+    def __remember_session(self) -> None:
+        # TLS 1.3 delivers session tickets after the handshake, so this is also done again on close
+        if self.is_tls:
+            self.__session_cache.put(self.__host, self.__port, self.__socket.context, self.__socket.session)
+
+    def __park(self) -> bool:
+        """Called by an I/O thread woken through its pipe. Returns True if the thread should keep running"""
+        if self.__exit_event.is_set() or not self.__upgrading.is_set():
+            return False
+        self.__parked.release()
+        self.__resume.wait()
+        return not self.__exit_event.is_set()
 
     def __thread_sendbuf(self):
         debugLog = self._logger.debug
         getSend = self.send_queue.get
+        getSendNowait = self.send_queue.get_nowait
         getDone = self.send_queue.task_done
         ex_event = self.__exit_event.is_set
         send_buf = bytearray()
@@ -85,18 +233,24 @@ class Transport:
 
         while not ex_event():
             with suppress:
-                msg = getSend(timeout=0.01)
+                # Don't wait on the queue while there is still something to send
+                msg = getSend(timeout=0 if send_buf else 0.01)
                 send_buf.extend(msg)
                 getDone()
+                # Coalesce whatever else is already queued into the same write
+                while len(send_buf) < MAX_COALESCE_BYTES:
+                    send_buf.extend(getSendNowait())
+                    getDone()
 
             r, w, _ = select.select([pipe], [self.__socket], [], 10)
             if r:
-                with os.fdopen(pipe) as fd:
-                    fd.read(1)
+                os.read(pipe, 1)
+                if self.__park():
+                    continue
                 break
             if w and send_buf:
-                num_sent = self.__socket.send(bytes(send_buf))
-                send_buf = send_buf[num_sent:]
+                num_sent = self.__socket.send(send_buf)
+                del send_buf[:num_sent]
                 debugLog("Sent %s bytes over socket from send buffer", num_sent)
         self._logger.info("Finished send thread")
 
@@ -110,19 +264,26 @@ class Transport:
 
         while not ex.is_set():
             try:
-                r, _, e = select.select([self.__socket, pipe], [], [self.__socket], 10)
+                if self.is_tls and self.__socket.pending():
+                    # Data that arrived with the handshake is already decrypted and won't wake select
+                    r, e = [self.__socket], []
+                else:
+                    r, _, e = select.select([self.__socket, pipe], [], [self.__socket], 10)
 
                 if e:
                     errorLog("THIS IS BAD")
 
                 if pipe in r:
                     debugLog("Got message from OS pipe to leave thread.")
-                    with os.fdopen(pipe) as fd:
-                        fd.read(1)
+                    os.read(pipe, 1)
+                    if self.__park():
+                        continue
                     break
                 if self.__socket in r:
                     data = self.__socket.recv(1024)
                     recv_buf.extend(data)
+                    while self.is_tls and self.__socket.pending():
+                        recv_buf.extend(self.__socket.recv(self.__socket.pending()))
                 while recv_buf:
                     bytes_processed = wire.parse_stream(recv_buf, put_queue)
                     debugLog(
@@ -132,6 +293,8 @@ class Transport:
                     if bytes_processed == 0 or not recv_buf:
                         break
 
+            except self.__want_read:
+                continue
             except socket.error as e:
                 errorLog(f"SOCKET ERROR: {e}")
             except Full:
@@ -0,0 +1,164 @@
+"""Watchdog that times message callbacks and samples the stack of ones that run over budget"""
+
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+
+@dataclass
+class SlowCallback:
+    callback_id: str
+    subject: str
+    # Seconds it had been running when the stack was sampled, updated to the full duration once it returns
+    duration: float
+    stack: List[str]
+
+
+@dataclass
+class CallbackStats:
+    callback_id: str
+    calls: int = 0
+    slow_calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    # Most recent durations, for percentiles
+    recent: Deque[float] = field(default_factory=lambda: deque(maxlen=1024))
+
+    def percentile(self, pct: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+@dataclass
+class _Invocation:
+    callback_id: str
+    subject: str
+    start: float
+    slow: Optional[SlowCallback] = None
+
+
+class CallbackWatchdog:
+    def __init__(self, budget: float = 0.1, max_reports: int = 100) -> None:
+        """Time every callback invocation and, from a separate thread, capture the stack of any callback still
+        running after `budget` seconds so the handler stalling dispatch can be found.
+
+        Inputs:
+            budget: Seconds a single callback invocation may take before it is reported
+            max_reports: How many of the most recent slow invocations to keep
+        """
+        self.budget = budget
+        self.__stats: Dict[str, CallbackStats] = {}
+        self.__slow: Deque[SlowCallback] = deque(maxlen=max_reports)
+        # Thread id to the callbacks it is running. A stack, since local delivery can nest callbacks
+        self.__running: Dict[int, List[_Invocation]] = {}
+        self.__lock = threading.Lock()
+        self.__exit_event = threading.Event()
+        self.__thread: threading.Thread = None
+        self._logger = logging.getLogger("pynats.watchdog")
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.__thread_watch, daemon=True)
+        self.__thread.start()
+
+    def close(self) -> None:
+        self.__exit_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def begin(self, callback_id: str, subject: str) -> _Invocation:
+        invocation = _Invocation(callback_id, subject, time.perf_counter())
+        with self.__lock:
+            self.__running.setdefault(threading.get_ident(), []).append(invocation)
+        return invocation
+
+    def end(self, invocation: _Invocation) -> None:
+        duration = time.perf_counter() - invocation.start
+        with self.__lock:
+            running = self.__running.get(threading.get_ident())
+            if running:
+                running.remove(invocation)
+            stats = self.__stats.get(invocation.callback_id)
+            if stats is None:
+                stats = self.__stats[invocation.callback_id] = CallbackStats(invocation.callback_id)
+            stats.calls += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.recent.append(duration)
+            if invocation.slow is not None:
+                stats.slow_calls += 1
+                invocation.slow.duration = duration
+
+    def __thread_watch(self) -> None:
+        interval = self.budget / 2
+        while not self.__exit_event.wait(interval):
+            now = time.perf_counter()
+            with self.__lock:
+                overdue = [
+                    (thread_id, invocation)
+                    for thread_id, running in self.__running.items()
+                    for invocation in running
+                    if invocation.slow is None and now - invocation.start > self.budget
+                ]
+                if not overdue:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, invocation in overdue:
+                    frame = frames.get(thread_id)
+                    stack = traceback.format_stack(frame) if frame is not None else []
+                    invocation.slow = SlowCallback(
+                        invocation.callback_id, invocation.subject, now - invocation.start, stack
+                    )
+                    self.__slow.append(invocation.slow)
+            for _, invocation in overdue:
+                self._logger.warning(
+                    "Callback %s on '%s' has been running for %.3fs:\n%s",
+                    invocation.callback_id,
+                    invocation.subject,
+                    invocation.slow.duration,
+                    "".join(invocation.slow.stack),
+                )
+
+    def slowCallbacks(self) -> List[SlowCallback]:
+        """The most recent callback invocations that ran over budget, oldest first"""
+        with self.__lock:
+            return list(self.__slow)
+
+    def cumulativeTime(self, callback_id: str) -> float:
+        """Total seconds spent in a callback"""
+        with self.__lock:
+            stats = self.__stats.get(callback_id)
+            return stats.total_time if stats is not None else 0.0
+
+    def cumulativeTimes(self) -> Dict[str, float]:
+        """Total seconds spent in each callback that has run"""
+        with self.__lock:
+            return {callback_id: stats.total_time for callback_id, stats in self.__stats.items()}
+
+    def report(self) -> List[dict]:
+        """Timing of every callback that has been over budget, worst total time first"""
+        with self.__lock:
+            offenders = [stats for stats in self.__stats.values() if stats.slow_calls]
+            subjects = {}
+            for slow in self.__slow:
+                subjects.setdefault(slow.callback_id, set()).add(slow.subject)
+            return [
+                {
+                    "callback_id": stats.callback_id,
+                    "subjects": sorted(subjects.get(stats.callback_id, ())),
+                    "calls": stats.calls,
+                    "slow_calls": stats.slow_calls,
+                    "total_time": stats.total_time,
+                    "p50": stats.percentile(50),
+                    "p90": stats.percentile(90),
+                    "p99": stats.percentile(99),
+                    "max": stats.max_time,
+                }
+                for stats in sorted(offenders, key=lambda stats: stats.total_time, reverse=True)
+            ]
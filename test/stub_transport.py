@@ -0,0 +1,21 @@
+"""A Transport stand-in for driving the protocol without a socket, shared by the tests"""
+
+from queue import Queue
+
+from pynats.transport import ConnectTimings
+
+
+class StubTransport:
+    """Collects what the protocol would send, without a socket"""
+
+    def __init__(self) -> None:
+        self.send_queue = Queue()
+        self.recv_queue = Queue()
+        self.timings = ConnectTimings()
+        self.connected_at = 0.0
+
+    def sent(self) -> list:
+        frames = []
+        while not self.send_queue.empty():
+            frames.append(self.send_queue.get_nowait())
+        return frames
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Test payload codecs"""
+
+import os
+import sys
+from collections import namedtuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from pynats.codec import Codec, CodecRegistry, JsonCodec, PickleCodec, StructCodec
+from pynats.protocol.wire import MsgMessage
+
+Tick = namedtuple("Tick", ["seq", "price"])
+
+
+class CountingCodec(JsonCodec):
+    def __init__(self) -> None:
+        self.decoded = 0
+
+    def decode(self, data):
+        self.decoded += 1
+        return super().decode(data)
+
+
+def test_most_specific_pattern_wins() -> None:
+    registry = CodecRegistry()
+    json_codec, struct_codec, pickle_codec = JsonCodec(), StructCodec("<Qd", Tick), PickleCodec()
+    registry.register("EVENTS.>", json_codec)
+    registry.register("EVENTS.*.TICK", struct_codec)
+    registry.register("EVENTS.FX.RAW", pickle_codec)
+
+    assert registry.codecFor("EVENTS.FX.TICK") is struct_codec
+    assert registry.codecFor("EVENTS.FX.RAW") is pickle_codec
+    assert registry.codecFor("EVENTS.FX") is json_codec
+    assert registry.codecFor("OTHER") is None
+
+    registry.register("EVENTS.*.TICK", None)
+    assert registry.codecFor("EVENTS.FX.TICK") is json_codec
+
+
+def test_round_trip_and_lazy_decode() -> None:
+    registry = CodecRegistry()
+    registry.register("TICKS", StructCodec("<Qd", Tick))
+    payload = registry.encode("TICKS", Tick(7, 1.5))
+    msg = MsgMessage(b"MSG", "TICKS", "1", payload, codec=registry.codecFor("TICKS"))
+    assert msg.data == Tick(7, 1.5)
+
+    counting = CountingCodec()
+    msg = MsgMessage(b"MSG", "JSON", "1", counting.encode({"a": [1, 2]}), codec=counting)
+    assert counting.decoded == 0
+    assert msg.data == {"a": [1, 2]} and msg.data == {"a": [1, 2]}
+    assert counting.decoded == 1
+
+    assert MsgMessage(b"MSG", "RAW", "1", b"raw").data == b"raw"
+    assert registry.encode("ANY", b"bytes") == b"bytes"
+    assert isinstance(counting, Codec)
+
+
+if __name__ == "__main__":
+    test_most_specific_pattern_wins()
+    test_round_trip_and_lazy_decode()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Test the message id deduplication window"""
+
+import os
+import sys
+import time
+from threading import Event
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from stub_transport import StubTransport
+
+import pynats.protocol.wire as wire
+from pynats.dedup import DedupFilter
+from pynats.protocol.nats import Protocol
+
+
+def test_window() -> None:
+    dedup = DedupFilter(window=0.05)
+    results = [dedup.isDuplicate(msg_id) for msg_id in ("a", "b", "a", None, "b")]
+    assert results == [False, False, True, False, True]
+
+    time.sleep(0.06)
+    assert not dedup.isDuplicate("a")
+    assert dedup.stats() == {"checked": 5, "duplicates": 2, "bloom_duplicates": 0, "tracked": 1}
+
+
+def test_bloom_catches_evicted_ids() -> None:
+    exact = DedupFilter(max_ids=10)
+    bloom = DedupFilter(max_ids=10, bloom_bits=8 * 1000)
+    ids = [f"id-{i}" for i in range(100)]
+    for msg_id in ids:
+        exact.isDuplicate(msg_id)
+        bloom.isDuplicate(msg_id)
+
+    assert not exact.isDuplicate(ids[0])
+    assert sum(bloom.isDuplicate(msg_id) for msg_id in ids) == 100
+    assert bloom.stats()["bloom_duplicates"] >= 90
+
+
+def test_overlapping_subscriptions_all_deliver() -> None:
+    protocol = Protocol(StubTransport(), connected=Event())
+    protocol.dedup = DedupFilter()
+    got = []
+    protocol.addCB(got.append)
+    exact_sid = protocol.sub("PRICES.A")
+    wildcard_sid = protocol.sub("PRICES.*")
+
+    def hmsg(sid: int, reply_to: str = "") -> wire.HmsgMessage:
+        return wire.HmsgMessage(b"HMSG", "PRICES.A", str(sid), {wire.MSG_ID_HEADER: "x"}, b"1", reply_to)
+
+    # The server sends one copy per matching subscription, all with the same id
+    protocol.handleProtocolHmsg(hmsg(exact_sid))
+    protocol.handleProtocolHmsg(hmsg(wildcard_sid))
+    assert [msg.sid for msg in got] == [str(exact_sid), str(wildcard_sid)]
+    assert protocol.dedup.duplicates == 0
+
+    protocol.handleProtocolHmsg(hmsg(exact_sid))
+    assert len(got) == 2 and protocol.dedup.duplicates == 1
+
+    # JetStream redeliveries keep their id and must still get through
+    for _ in range(2):
+        protocol.handleProtocolHmsg(hmsg(exact_sid, "$JS.ACK.S.C.2.1.1.0.0"))
+    assert len(got) == 4
+
+
+if __name__ == "__main__":
+    test_window()
+    test_bloom_catches_evicted_ids()
+    test_overlapping_subscriptions_all_deliver()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Test the pre-warmed ConnectionFactory against a stand-in server"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats
+
+
+def serve(listener: socket.socket) -> None:
+    """Just enough of a NATS server to let clients connect and publish"""
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        conn.sendall(
+            b'INFO {"server_id":"x","server_name":"x","version":"2.10.0","headers":true,'
+            b'"max_payload":1048576,"proto":1} \r\n'
+        )
+        threading.Thread(target=drain, args=(conn,), daemon=True).start()
+
+
+def drain(conn: socket.socket) -> None:
+    with conn:
+        while conn.recv(4096):
+            pass
+
+
+def test_warm_first_publish_excludes_pool_time() -> None:
+    listener = socket.create_server(("127.0.0.1", 0))
+    threading.Thread(target=serve, args=(listener,), daemon=True).start()
+    factory = pynats.ConnectionFactory("127.0.0.1", listener.getsockname()[1], warm=1)
+    deadline = time.monotonic() + 2
+    while factory.stats()["warm"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Sits in the pool for a while before it's wanted
+    time.sleep(0.3)
+
+    client = factory.get()
+    assert client.send("A", b"first")
+    factory.close()
+    client.close()
+    listener.close()
+
+    assert factory.stats()["warm_hits"] == 1
+    assert 0 < client.connect_timings.first_publish < 0.3
+
+
+if __name__ == "__main__":
+    test_warm_first_publish_excludes_pool_time()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Test the JetStream pull consumer against a stand-in server that emulates the pull and ack subjects"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats
+from pynats.error import NATSException
+from pynats.jetstream import JetStreamMetadata, PullConsumer
+from pynats.ratelimit import RateLimit
+
+STREAM = "ORDERS"
+CONSUMER = "worker"
+
+
+class StandInServer:
+    """Just enough of a NATS server with JetStream to serve MSG.NEXT requests and record acks"""
+
+    def __init__(self, messages: int) -> None:
+        self.stream = [f"order {i}".encode() for i in range(1, messages + 1)]
+        self.next_seq = 0
+        self.acks = []
+        self.subs = {}
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self) -> None:
+        conn, _ = self.listener.accept()
+        info = {"server_id": "x", "server_name": "x", "version": "2.10.0", "headers": True, "max_payload": 1048576}
+        info.update({"proto": 1, "jetstream": True})
+        conn.sendall(b"INFO " + json.dumps(info).encode() + b" \r\n")
+        reader = conn.makefile("rb")
+        for line in reader:
+            op, *args = line.decode().split()
+            if op == "CONNECT":
+                conn.sendall(b"+OK\r\n")
+            elif op == "SUB":
+                self.subs[args[0]] = args[-1]
+            elif op == "PUB":
+                payload = reader.read(int(args[-1]) + 2)[:-2]
+                self.handlePub(conn, args[0], args[1] if len(args) == 3 else None, payload)
+
+    def handlePub(self, conn: socket.socket, subject: str, reply_to: str, payload: bytes) -> None:
+        if subject.startswith("$JS.ACK."):
+            self.acks.append((subject, payload))
+            return
+        if subject != f"$JS.API.CONSUMER.MSG.NEXT.{STREAM}.{CONSUMER}":
+            return
+        request = json.loads(payload)
+        sid = self.subs[reply_to.rsplit(".", 1)[0] + ".*"]
+        frames = b""
+        for _ in range(request["batch"]):
+            if self.next_seq == len(self.stream):
+                status = b"NATS/1.0 404 No Messages\r\n\r\n"
+                frames += f"HMSG {reply_to} {sid} {len(status)} {len(status)}\r\n".encode() + status + b"\r\n"
+                break
+            data = self.stream[self.next_seq]
+            self.next_seq += 1
+            pending = len(self.stream) - self.next_seq
+            ack = f"$JS.ACK.{STREAM}.{CONSUMER}.1.{self.next_seq}.{self.next_seq}.{time.time_ns()}.{pending}"
+            frames += f"MSG {reply_to} {sid} {ack} {len(data)}\r\n".encode() + data + b"\r\n"
+        conn.sendall(frames)
+
+
+def test_metadata() -> None:
+    metadata = JetStreamMetadata.parse("$JS.ACK.ORDERS.worker.2.10.4.1700000000000000000.5")
+    assert metadata == JetStreamMetadata("ORDERS", "worker", 2, 10, 4, 1700000000000000000, 5)
+    metadata = JetStreamMetadata.parse("$JS.ACK.hub.ACCHASH.ORDERS.worker.1.3.3.1700000000000000000.0.abc")
+    assert metadata.domain == "hub" and metadata.stream_seq == 3
+    assert JetStreamMetadata.parse("_INBOX.abc") is None
+
+
+def test_pull_consumer() -> None:
+    server = StandInServer(messages=5)
+    client = pynats.NATSClient("127.0.0.1", server.port)
+    client.start()
+    consumer = PullConsumer(client, STREAM, CONSUMER, batch=3, expires=1.0, ack_interval=0.05)
+
+    first = consumer.fetch()
+    assert [msg.payload for msg in first] == [b"order 1", b"order 2", b"order 3"]
+    assert first[0].metadata.stream_seq == 1 and first[2].metadata.num_pending == 2
+    for msg in first:
+        assert msg.ack()
+    assert not first[0].ack()
+
+    # Only two left, so the batch is cut short by the 404
+    second = consumer.fetch()
+    assert [msg.payload for msg in second] == [b"order 4", b"order 5"]
+    second[0].ack()
+    second[1].nak()
+    assert consumer.fetch(expires=0) == []
+    consumer.close()
+    deadline = time.monotonic() + 2
+    while len(server.acks) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.close()
+
+    assert [payload for _, payload in server.acks] == [b"+ACK"] * 4 + [b"-NAK"]
+    assert server.acks[0][0].startswith(f"$JS.ACK.{STREAM}.{CONSUMER}.1.1.1.")
+    assert consumer.stats()["fetched"] == 5
+
+
+def test_ack_all_sends_highest_sequence() -> None:
+    server = StandInServer(messages=5)
+    client = pynats.NATSClient("127.0.0.1", server.port)
+    client.start()
+    # Long enough that everything goes out in the one flush on close
+    consumer = PullConsumer(client, STREAM, CONSUMER, batch=5, expires=1.0, ack_interval=60, ack_all=True)
+
+    msgs = consumer.fetch()
+    msgs[4].ack()
+    msgs[2].ack()
+    msgs[0].nak()
+    consumer.close()
+    deadline = time.monotonic() + 2
+    while len(server.acks) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.close()
+
+    assert [payload for _, payload in server.acks] == [b"+ACK", b"-NAK"]
+    assert server.acks[0][0] == msgs[4].reply_to
+
+
+def test_fetch_fails_fast_when_not_sent() -> None:
+    server = StandInServer(messages=5)
+    client = pynats.NATSClient(
+        "127.0.0.1", server.port, rate_limit=RateLimit(msgs_per_sec=1, burst_msgs=1), rate_limit_policy="fail"
+    )
+    client.start()
+    consumer = PullConsumer(client, STREAM, CONSUMER, batch=1, expires=5.0)
+    assert len(consumer.fetch()) == 1
+
+    start = time.monotonic()
+    try:
+        consumer.fetch()
+    except NATSException:
+        pass
+    else:
+        raise AssertionError("Expected the rate limited request to fail")
+    assert time.monotonic() - start < 1.0
+    consumer.close()
+    client.close()
+
+
+if __name__ == "__main__":
+    test_metadata()
+    test_pull_consumer()
+    test_ack_all_sends_highest_sequence()
+    test_fetch_fails_fast_when_not_sent()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Test no_echo and local delivery of a client's own publishes, using a stub transport"""
+
+import json
+import os
+import sys
+from threading import Event
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from stub_transport import StubTransport
+
+import pynats.protocol.wire as wire
+from pynats.protocol.nats import Protocol
+
+INFO = {"server_id": "x", "server_name": "x", "version": "2.10.0", "headers": True, "max_payload": 1048576, "proto": 1}
+
+
+def connectOptions(transport: StubTransport) -> dict:
+    connect = next(frame for frame in transport.sent() if frame.startswith(b"CONNECT "))
+    return json.loads(connect[len(b"CONNECT ") :])
+
+
+def test_connect_echo() -> None:
+    for kwargs, echo in (({}, None), ({"no_echo": True}, False), ({"local_delivery": True}, False)):
+        transport = StubTransport()
+        protocol = Protocol(transport, connected=Event(), **kwargs)
+        protocol.handleProtocolInfo(wire.InfoMessage(b"INFO", INFO))
+        assert connectOptions(transport).get("echo") is echo
+
+
+def test_local_delivery_once_per_sid() -> None:
+    transport = StubTransport()
+    protocol = Protocol(transport, connected=Event(), local_delivery=True)
+    got = []
+    protocol.addCB(got.append)
+    exact_sid = protocol.sub("ORDERS.new")
+    wildcard_sid = protocol.sub("ORDERS.*")
+    protocol.sub("ORDERS.new", "workers")
+    protocol.sub("OTHER")
+    transport.sent()
+
+    assert protocol.send("ORDERS.new", b"1", None, None)
+    # Queue group members are left to the server, which picks one member of the group
+    assert sorted(msg.sid for msg in got) == sorted([str(exact_sid), str(wildcard_sid)])
+    assert protocol.local_deliveries == 2
+    # And it is still published for everyone else
+    assert transport.sent() == [wire.buildPub("ORDERS.new", b"1", None)]
+
+
+if __name__ == "__main__":
+    test_connect_echo()
+    test_local_delivery_once_per_sid()
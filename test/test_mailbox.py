@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Test mailbox conflation"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from pynats.mailbox import Mailbox
+from pynats.protocol.wire import HmsgMessage, MsgMessage
+
+
+def test_conflation() -> None:
+    mailbox = Mailbox("PRICES.*")
+    for i in range(5):
+        mailbox(MsgMessage(b"MSG", "PRICES.A", "1", str(i).encode()))
+    mailbox(MsgMessage(b"MSG", "PRICES.B", "1", b"b"))
+    mailbox(MsgMessage(b"MSG", "PRICES.A", "1", b"last"))
+
+    assert len(mailbox) == 2
+    assert mailbox.get(timeout=0).payload == b"last"
+    assert mailbox.get(timeout=0).payload == b"b"
+    assert mailbox.get(timeout=0) is None
+    assert mailbox.stats() == {"pending": 0, "received": 7, "delivered": 2, "conflated": 5, "dropped": 0}
+    assert mailbox.conflated_by_key == {"PRICES.A": 5}
+
+
+def test_header_key_and_bound() -> None:
+    mailbox = Mailbox("STATUS", key_header="Device", max_keys=2)
+    for device in ("a", "b", "a", "c"):
+        mailbox(HmsgMessage(b"HMSG", "STATUS", "1", {"Device": device}, device.encode()))
+    mailbox(MsgMessage(b"MSG", "STATUS", "1", b"no header"))
+
+    assert [msg.payload for msg in mailbox.drain()] == [b"c", b"no header"]
+    assert mailbox.conflated == 1
+    assert mailbox.dropped == 2
+
+
+def test_conflation_counts_are_bounded() -> None:
+    mailbox = Mailbox("DEVICES.*", max_keys=10)
+    for i in range(1000):
+        for _ in range(2):
+            mailbox(MsgMessage(b"MSG", f"DEVICES.{i}", "1", b"x"))
+
+    assert mailbox.conflated == 1000
+    assert list(mailbox.conflated_by_key) == [f"DEVICES.{i}" for i in range(990, 1000)]
+
+
+if __name__ == "__main__":
+    test_conflation()
+    test_header_key_and_bound()
+    test_conflation_counts_are_bounded()
@@ -44,13 +44,13 @@ def test_json() -> None:
 
 def test_msg():
     msgs = [
-        "FOO.BAR 9 11\r\nHello World\r\n".encode(),
-        "FOO.BAR 9 GREETING.34 11\r\nHello World\r\n".encode(),
+        "MSG FOO.BAR 9 11\r\nHello World\r\n".encode(),
+        "MSG FOO.BAR 9 GREETING.34 11\r\nHello World\r\n".encode(),
     ]
     fails = []
     for msg in msgs:
-        a = protocol.RE_MSG_BODY.match(msg)
-        if a is None:
+        a, _ = protocol.parseMsg(bytearray(msg))
+        if a is None or a.payload != b"Hello World":
             fails.append(msg)
             continue
     if not fails:
@@ -60,14 +60,14 @@ def test_msg():
 
 def test_hmsg():
     msgs = [
-        "FOO.BAR 9 34 45\r\nNATS/1.0\r\nFoodGroup: vegetable\r\n\r\nHello World\r\n".encode(),
-        "FOO.BAR 9 BAZ.69 34 45\r\nNATS/1.0\r\nFoodGroup: vegetable\r\n\r\nHello World\r\n".encode(),
+        "HMSG FOO.BAR 9 34 45\r\nNATS/1.0\r\nFoodGroup: vegetable\r\n\r\nHello World\r\n".encode(),
+        "HMSG FOO.BAR 9 BAZ.69 34 45\r\nNATS/1.0\r\nFoodGroup: vegetable\r\n\r\nHello World\r\n".encode(),
     ]
     fails = []
 
     for msg in msgs:
-        a = protocol.RE_HMSG_BODY.match(msg)
-        if a is None:
+        a, _ = protocol.parseHmsg(bytearray(msg))
+        if a is None or a.header != {"FoodGroup": "vegetable"}:
             fails.append(msg)
 
     if not fails:
@@ -76,8 +76,29 @@ def test_hmsg():
         print(f"Failed HMSG tests: {fails}")
 
 
+def test_subject_matches():
+    tests = (
+        ("FOO.BAR", "FOO.BAR", True),
+        ("FOO.*", "FOO.BAR", True),
+        ("FOO.*", "FOO.BAR.BAZ", False),
+        ("FOO.>", "FOO.BAR.BAZ", True),
+        ("FOO.>", "FOO", False),
+        ("*.BAR", "FOO.BAR", True),
+        ("FOO.BAR", "FOO.BAZ", False),
+        ("FOO.BAR.BAZ", "FOO.BAR", False),
+    )
+    fails = [test for test in tests if protocol.subjectMatches(test[0], test[1]) is not test[2]]
+
+    if not fails:
+        print("Passed all subject matching tests")
+    else:
+        print(f"Failed subject matching tests: {fails}")
+    assert not fails
+
+
 if __name__ == "__main__":
     test_delimiters()
     test_json()
     test_msg()
-    test_hmsg()
\ No newline at end of file
+    test_hmsg()
+    test_subject_matches()
\ No newline at end of file
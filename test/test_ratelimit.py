@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Test publish rate limiting"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats
+from pynats.ratelimit import FAIL, QUEUE, RateLimit, RateLimiter
+
+
+def test_fail_fast() -> None:
+    limiter = RateLimiter(RateLimit(msgs_per_sec=5), FAIL)
+    sent = []
+    results = [limiter.submit("FOO", b"x", sent.append) for _ in range(10)]
+
+    assert results.count(True) == 5
+    assert len(sent) == 5
+    assert limiter.stats()["rejected"] == 5
+
+
+def test_prefix_limit_and_queue() -> None:
+    limiter = RateLimiter(policy=QUEUE)
+    limiter.setSubjectLimit("SLOW.", RateLimit(msgs_per_sec=100, burst_msgs=1))
+    sent = []
+    start = time.monotonic()
+    for i in range(5):
+        assert limiter.submit("SLOW.A", str(i).encode(), sent.append)
+    limiter.submit("FAST", b"fast", sent.append)
+    while len(sent) < 6 and time.monotonic() - start < 1:
+        time.sleep(0.005)
+    limiter.close()
+
+    # Queued publishes keep their order, and the unlimited subject waits behind them
+    assert sent == [b"0", b"1", b"2", b"3", b"4", b"fast"]
+    assert time.monotonic() - start >= 0.04
+    assert limiter.stats()["queued"] == 5
+
+
+def test_client_checks_policy() -> None:
+    try:
+        pynats.NATSClient("127.0.0.1", 4222, rate_limit_policy="drop")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected an unknown policy to be rejected")
+
+
+if __name__ == "__main__":
+    test_fail_fast()
+    test_prefix_limit_and_queue()
+    test_client_checks_policy()
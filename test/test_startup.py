@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Test that importing pynats leaves the heavy modules for later"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.append(ROOT)
+
+
+def loadedAfter(statement: str, modules) -> list:
+    script = f"import sys\n{statement}\nprint(' '.join(name for name in {modules!r} if name in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_lazy_import() -> None:
+    assert loadedAfter("import pynats", ("ssl", "json", "uuid", "pynats.connection")) == []
+    assert loadedAfter("from pynats import NATSClient", ("ssl", "uuid", "pynats.codec")) == []
+    assert loadedAfter("from pynats import JsonCodec", ("pynats.codec",)) == ["pynats.codec"]
+
+
+def test_unknown_attribute() -> None:
+    import pynats
+
+    assert not hasattr(pynats, "NotAThing")
+
+
+if __name__ == "__main__":
+    test_lazy_import()
+    test_unknown_attribute()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Test the integer sid subscription table"""
+
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from stub_transport import StubTransport
+
+import pynats.protocol.wire as wire
+from pynats.mailbox import Mailbox
+from pynats.protocol.nats import SUB_BATCH_BYTES, Protocol
+from pynats.protocol.subscriptions import SubscriptionTable
+
+
+def test_multiple_subscriptions_per_subject() -> None:
+    table = SubscriptionTable()
+    first = table.add("orders.new")
+    second = table.add("orders.new", "workers")
+    wildcard = table.add("orders.*")
+
+    assert (first, second, wildcard) == (1, 2, 3)
+    assert table.sids("orders.new") == (1, 2)
+    assert table.subject("2") == "orders.new"
+    assert table.queueGroup(second) == "workers"
+    assert len(table) == 3
+
+    # Queue group members are only reached through the server
+    assert table.matching("orders.new") == [1, 3]
+    assert table.matching("orders.new", include_queue_groups=True) == [1, 2, 3]
+
+    assert table.remove(first) == "orders.new"
+    assert table.remove(first) is None
+    assert table.sids("orders.new") == (2,)
+    assert table.subject("nonsense") is None
+
+
+def test_sids_are_not_reused_after_trimming() -> None:
+    table = SubscriptionTable()
+    sids = [table.add(f"device.{i}") for i in range(5000)]
+    for sid in sids[:-1]:
+        table.remove(sid)
+
+    assert len(table) == 1
+    assert list(table.items()) == [(5000, "device.4999", None)]
+    assert table.subject(sids[0]) is None
+    assert table.add("device.new") == 5001
+
+
+def test_lookups_while_trimming() -> None:
+    table = SubscriptionTable()
+    sids = [table.add(f"device.{i}") for i in range(1100)]
+    live = table.add("live")
+    readers = []
+    looked_up = []
+
+    class LookUpMidTrim(list):
+        """Looks the live subscription up from another thread in the middle of trimming the table"""
+
+        def __delitem__(self, index) -> None:
+            super().__delitem__(index)
+            reader = threading.Thread(target=lambda: looked_up.append(table.subject(live)))
+            reader.start()
+            # Waits on the table's lock until the trim is done
+            reader.join(0.05)
+            readers.append(reader)
+
+    table._SubscriptionTable__queue_groups = LookUpMidTrim(table._SubscriptionTable__queue_groups)
+    for sid in sids:
+        table.remove(sid)
+    for reader in readers:
+        reader.join()
+    assert len(readers) == 1
+    assert looked_up == ["live"]
+
+
+def test_subject_callbacks_run_once_per_message() -> None:
+    protocol = Protocol(StubTransport(), connected=threading.Event())
+    mailbox = Mailbox("A")
+    protocol.addCB(mailbox, "A")
+    workers = protocol.sub("A", "workers")
+    plain = protocol.sub("A")
+    bound = []
+    bound_sid = protocol.sub("A", "q", callback=bound.append)
+
+    # The server sends a copy of a publish to every subscription, in whatever order
+    for sid in (workers, bound_sid, plain):
+        protocol.handleProtocolMsg(wire.MsgMessage(b"MSG", "A", str(sid), b"1"))
+    assert mailbox.stats()["received"] == 1 and mailbox.conflated == 0
+    # The subscription that runs them gets every message, whichever members of the queue groups are picked
+    assert mailbox.get(timeout=0).sid == str(plain)
+    assert [msg.sid for msg in bound] == [str(bound_sid)]
+
+    protocol.unsub("A", sid=plain)
+    protocol.handleProtocolMsg(wire.MsgMessage(b"MSG", "A", str(workers), b"2"))
+    protocol.handleProtocolMsg(wire.MsgMessage(b"MSG", "A", str(bound_sid), b"2"))
+    assert mailbox.stats()["received"] == 2 and len(bound) == 2
+
+    protocol.unsub("A", sid=bound_sid)
+    assert not protocol.sid_callbacks
+
+
+def test_sub_many_batches() -> None:
+    transport = StubTransport()
+    protocol = Protocol(transport, connected=threading.Event())
+    subjects = [f"device.{i}.status" for i in range(10000)]
+    sids = protocol.subMany(subjects, "workers")
+
+    assert sids == list(range(1, 10001))
+    frames = transport.sent()
+    # Each batch is queued as soon as it reaches SUB_BATCH_BYTES, and the rest at the end
+    assert len(frames) > 1
+    assert all(len(frame) >= SUB_BATCH_BYTES for frame in frames[:-1])
+    assert all(len(frame) < SUB_BATCH_BYTES + 64 for frame in frames)
+    expected = [wire.buildSub(subject, sid, "workers") for sid, subject in enumerate(subjects, start=1)]
+    assert b"".join(frames) == b"".join(expected)
+
+    assert protocol.subMany([]) == []
+    assert transport.sent() == []
+
+
+def test_unsub_many_batches() -> None:
+    transport = StubTransport()
+    protocol = Protocol(transport, connected=threading.Event())
+    subjects = [f"device.{i}.status" for i in range(10000)]
+    sids = protocol.subMany(subjects)
+    doubled = protocol.sub(subjects[0], "workers")
+    transport.sent()
+
+    # Unknown subjects and repeats are skipped, and every subscription to a subject is removed
+    assert protocol.unsubMany([*subjects, "nonsense", subjects[1]]) == 10001
+    frames = transport.sent()
+    assert len(frames) > 1
+    assert all(len(frame) >= SUB_BATCH_BYTES for frame in frames[:-1])
+    unsubs = [wire.buildUnsub(sids[0]), wire.buildUnsub(doubled), *(wire.buildUnsub(sid) for sid in sids[1:])]
+    assert b"".join(frames) == b"".join(unsubs)
+    assert len(protocol.subscriptions) == 0
+
+    assert protocol.unsubMany(subjects) == 0
+    assert transport.sent() == []
+
+
+def test_unsub_by_sid() -> None:
+    transport = StubTransport()
+    protocol = Protocol(transport, connected=threading.Event())
+    first = protocol.sub("orders.new")
+    second = protocol.sub("orders.new", "workers")
+    third = protocol.sub("orders.new")
+    transport.sent()
+
+    assert protocol.unsub("orders.new", sid=second)
+    assert transport.sent() == [wire.buildUnsub(second)]
+    assert protocol.subscriptions.sids("orders.new") == (first, third)
+    assert not protocol.unsub("orders.new", sid=second)
+    assert transport.sent() == []
+
+    # Without a sid, every remaining subscription goes in one frame
+    assert protocol.unsub("orders.new", 5)
+    assert transport.sent() == [wire.buildUnsub(first, 5) + wire.buildUnsub(third, 5)]
+    assert "orders.new" not in protocol.subscriptions
+
+
+if __name__ == "__main__":
+    test_multiple_subscriptions_per_subject()
+    test_sids_are_not_reused_after_trimming()
+    test_lookups_while_trimming()
+    test_subject_callbacks_run_once_per_message()
+    test_sub_many_batches()
+    test_unsub_many_batches()
+    test_unsub_by_sid()
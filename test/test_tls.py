@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Test the TLS upgrade, TLS-first handshakes and session resumption against a stand-in TLS server"""
+
+import json
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats
+
+# Self signed for localhost and 127.0.0.1, only for these tests
+CERT = os.path.join(os.path.dirname(__file__), "config", "standin-cert.pem")
+KEY = os.path.join(os.path.dirname(__file__), "config", "standin-key.pem")
+
+
+class StandInServer:
+    """Just enough of a NATS server to upgrade to TLS (after INFO, or first) and echo PUBs to subscribers"""
+
+    def __init__(self, tls_first: bool = False) -> None:
+        self.tls_first = tls_first
+        self.context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.context.load_cert_chain(CERT, KEY)
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self) -> None:
+        while True:
+            conn, _ = self.listener.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn: socket.socket) -> None:
+        try:
+            if self.tls_first:
+                conn = self.context.wrap_socket(conn, server_side=True)
+            info = {"server_id": "x", "server_name": "x", "version": "2.10.0", "headers": True, "max_payload": 1048576}
+            info.update({"proto": 1, "tls_required": True})
+            conn.sendall(b"INFO " + json.dumps(info).encode() + b" \r\n")
+            if not self.tls_first:
+                conn = self.context.wrap_socket(conn, server_side=True)
+            subs = {}
+            reader = conn.makefile("rb")
+            for line in reader:
+                op, *args = line.decode().split()
+                if op == "CONNECT":
+                    conn.sendall(b"+OK\r\n")
+                elif op == "SUB":
+                    subs[args[0]] = args[-1]
+                elif op == "PUB":
+                    payload = reader.read(int(args[-1]) + 2)[:-2]
+                    if args[0] in subs:
+                        conn.sendall(f"MSG {args[0]} {subs[args[0]]} {len(payload)}\r\n".encode() + payload + b"\r\n")
+        except (OSError, ValueError):
+            # Clients that fail the handshake or hang up
+            return
+
+
+def clientContext() -> ssl.SSLContext:
+    return ssl.create_default_context(cafile=CERT)
+
+
+def roundTrip(client: pynats.NATSClient) -> list:
+    got = []
+    client.addCallback(got.append, "A")
+    client.subscribe("A")
+    client.send("A", b"over tls")
+    deadline = time.monotonic() + 2
+    while (not got or not client.connect_timings.connect) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return got
+
+
+def test_upgrade_and_resume() -> None:
+    server = StandInServer()
+    context = clientContext()
+    cache = pynats.TLSSessionCache()
+
+    first = pynats.NATSClient("localhost", server.port, tls=context, tls_session_cache=cache)
+    first.start()
+    got = roundTrip(first)
+    first.close()
+    assert [msg.payload for msg in got] == [b"over tls"]
+    timings = first.connect_timings
+    assert timings.tcp > 0 and timings.info > 0 and timings.tls > 0 and timings.connect > 0
+    assert not timings.tls_resumed
+
+    second = pynats.NATSClient("localhost", server.port, tls=context, tls_session_cache=cache)
+    second.start()
+    got = roundTrip(second)
+    second.close()
+    assert len(got) == 1
+    assert second.connect_timings.tls_resumed
+
+
+def test_tls_first() -> None:
+    server = StandInServer(tls_first=True)
+    client = pynats.NATSClient("localhost", server.port, tls=clientContext(), tls_first=True)
+    client.start()
+    got = roundTrip(client)
+    client.close()
+    assert len(got) == 1
+    assert client.connect_timings.tls > 0
+
+
+def test_handshake_failure_raises() -> None:
+    server = StandInServer()
+    # The default context doesn't trust the stand-in's self signed certificate
+    client = pynats.NATSClient("localhost", server.port, tls=ssl.create_default_context())
+    try:
+        client.start()
+    except ssl.SSLError:
+        pass
+    else:
+        raise AssertionError("Expected the handshake to fail")
+
+
+def test_tls_required_without_context_raises() -> None:
+    server = StandInServer()
+    client = pynats.NATSClient("localhost", server.port)
+    errors = []
+
+    def start() -> None:
+        try:
+            client.start()
+        except RuntimeError as e:
+            errors.append(e)
+
+    starter = threading.Thread(target=start, daemon=True)
+    starter.start()
+    starter.join(2)
+    assert not starter.is_alive(), "start() is still waiting for a connection that can't happen"
+    assert len(errors) == 1
+    # And the protocol and I/O threads were shut down, so they don't keep the process alive
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        left = [
+            thread for thread in threading.enumerate() if not thread.daemon and thread is not threading.main_thread()
+        ]
+        if not left:
+            break
+        time.sleep(0.01)
+    assert not left
+
+
+if __name__ == "__main__":
+    test_upgrade_and_resume()
+    test_tls_first()
+    test_handshake_failure_raises()
+    test_tls_required_without_context_raises()
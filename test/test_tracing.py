@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Test latency tracing histograms and timestamp headers"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import pynats.protocol.wire as wire
+from pynats.tracing import DISPATCH_TO_COMPLETE, PUBLISH_TO_PARSE, LatencyHistogram, LatencyTracer
+
+
+def test_histogram_precision() -> None:
+    histogram = LatencyHistogram()
+    for value in range(1, 100001):
+        histogram.record(value)
+
+    assert histogram.count == 100000
+    assert (histogram.min, histogram.max) == (1, 100000)
+    for percent in (50, 90, 99):
+        exact = 1000 * percent
+        assert exact <= histogram.percentile(percent) <= exact * 17 / 16
+    assert len(histogram.counts) < 300
+
+
+def test_tracer_records_stages() -> None:
+    tracer = LatencyTracer()
+    header = tracer.stamp({"a": "b"})
+    assert header["a"] == "b" and wire.TRACE_ID_HEADER in header
+    published_at = int(header[wire.TRACE_TS_HEADER], 16)
+
+    tracer.record("x", header, published_at + 2000, published_at + 3000, published_at + 10000)
+    tracer.record("y", {}, 0, 0, 0)
+    report = tracer.report("x")
+    assert report[PUBLISH_TO_PARSE]["max"] == 2e-6
+    assert report[DISPATCH_TO_COMPLETE]["p50"] == 7e-6
+    assert tracer.subjects() == ["x"]
+    assert LatencyTracer(sample_rate=0.0).stamp(None) is None
+
+
+def test_parse_stamps_traced_messages() -> None:
+    frame = wire.buildHpub("x", b"hi", {wire.TRACE_TS_HEADER: "1"}, None).replace(b"HPUB x", b"HMSG x 1", 1)
+    msg, _ = wire.parseHmsg(bytearray(frame))
+    assert msg.parsed_at > 0
+
+
+if __name__ == "__main__":
+    test_histogram_precision()
+    test_tracer_records_stages()
+    test_parse_stamps_traced_messages()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Test the slow callback watchdog"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from pynats.watchdog import CallbackWatchdog
+
+
+def slowHandler(duration: float) -> None:
+    time.sleep(duration)
+
+
+def test_slow_callback_sampled() -> None:
+    watchdog = CallbackWatchdog(budget=0.02)
+    watchdog.start()
+    for duration in (0.0, 0.1):
+        invocation = watchdog.begin("cb1", "FOO.BAR")
+        slowHandler(duration)
+        watchdog.end(invocation)
+    invocation = watchdog.begin("cb2", "FOO.BAZ")
+    watchdog.end(invocation)
+    watchdog.close()
+
+    slow = watchdog.slowCallbacks()
+    assert len(slow) == 1
+    assert slow[0].callback_id == "cb1" and slow[0].subject == "FOO.BAR"
+    assert slow[0].duration >= 0.1
+    assert any("slowHandler" in line for line in slow[0].stack)
+
+    report = watchdog.report()
+    assert [entry["callback_id"] for entry in report] == ["cb1"]
+    assert report[0]["calls"] == 2 and report[0]["slow_calls"] == 1
+    assert watchdog.cumulativeTime("cb1") >= 0.1
+    assert set(watchdog.cumulativeTimes()) == {"cb1", "cb2"}
+
+
+if __name__ == "__main__":
+    test_slow_callback_sampled()